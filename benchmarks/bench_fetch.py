@@ -0,0 +1,176 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_ebz_server import MockConfig, start_server
+
+# Fetch throughput of cml_dataset against the local mock EBZ API. Every
+# (max_workers, page size, mode) setting runs in a fresh process so peak RSS
+# and the module level session / page sizers are not shared between runs.
+#
+#   python -m benchmarks.bench_fetch --quick
+#   python -m benchmarks.bench_fetch --max_workers 1 8 16 --page_sizes 1000 10000 --records 20000
+
+ROOM_TOKEN = "mock-room"
+HCA_TOKEN = "mock-hca"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(base_url: str, building_id: int, max_workers: int, page_size: int, page_workers: int, mode: str) -> dict:
+    os.environ["room_details_token"] = ROOM_TOKEN
+    os.environ["hca_details_token"] = HCA_TOKEN
+    import cml_dataset
+    import ebz_client
+    from metadata_index import load_index
+
+    class FixedPageSizer(ebz_client.PageSizer):
+        """`page_size` for every page, the throughput of earlier pages is ignored."""
+
+        def observe(self, records: int, elapsed: float, n_bytes: int = 0):
+            pass
+
+    cml_dataset.baseurl = base_url
+    cml_dataset.room_page_sizer = FixedPageSizer(initial=page_size)
+    cml_dataset.hca_page_sizer = FixedPageSizer(initial=page_size)
+
+    # per_page of every request that was sent, to report the page size that was really used
+    per_page_sent = set()
+    get_json = ebz_client.get_json
+
+    def recording_get_json(url, token, params=None, **kwargs):
+        if params and "per_page" in params:
+            per_page_sent.add(int(params["per_page"]))
+        return get_json(url, token, params=params, **kwargs)
+
+    ebz_client.get_json = recording_get_json
+    ebz_client.RETRY_BACKOFF = 0.01
+    ebz_client.configure_cache(None)
+    ebz_client.configure_session(max_workers * page_workers, max_in_flight=max_workers)
+    ebz_client.metrics.reset()
+
+    rooms = len(load_index().rooms_of_building(building_id))
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    if mode == "stream":
+        with tempfile.TemporaryDirectory() as output_dir:
+            cml_dataset.stream_building_rooms(building_id, ROOM_TOKEN, output_dir, max_workers=max_workers,
+                                              page_workers=page_workers)
+    else:
+        cml_dataset.fetch_building_rooms(building_id, ROOM_TOKEN, max_workers=max_workers, page_workers=page_workers)
+    elapsed = time.perf_counter() - started
+
+    summary = ebz_client.metrics.summary()
+    rows = sum(stats["records"] for stats in summary["endpoints"].values())
+    return {
+        "building_id": building_id,
+        "mode": mode,
+        "max_workers": max_workers,
+        "page_size": page_size,
+        "per_page": "/".join(str(size) for size in sorted(per_page_sent)) or "-",
+        "page_workers": page_workers,
+        "rooms": rooms,
+        "rows": rows,
+        "requests": sum(stats["requests"] for stats in summary["endpoints"].values()),
+        "retries": sum(stats["retries"] for stats in summary["endpoints"].values()),
+        "failed": sum(stats["failed"] for stats in summary["endpoints"].values()),
+        "elapsed_s": elapsed,
+        "rooms_per_s": rooms / elapsed,
+        "rows_per_s": rows / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - rss_before,
+    }
+
+
+def run_config(base_url: str, building_id: int, max_workers: int, page_size: int, page_workers: int, mode: str) -> dict:
+    cmd = [
+        sys.executable, "-m", "benchmarks.bench_fetch", "--child",
+        "--base_url", base_url,
+        "--building_id", str(building_id),
+        "--max_workers", str(max_workers),
+        "--page_sizes", str(page_size),
+        "--page_workers", str(page_workers),
+        "--modes", mode,
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    # the fetch functions print progress, the result is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+COLUMNS = ["mode", "max_workers", "page_size", "per_page", "requests", "retries", "failed", "elapsed_s",
+           "rooms_per_s", "rows_per_s", "peak_rss_mb"]
+
+
+def format_row(result: dict) -> str:
+    return " ".join(f"{result[c]:>12.2f}" if isinstance(result[c], float) else f"{result[c]:>12}" for c in COLUMNS)
+
+
+def main(args):
+    if args.child:
+        result = run_child(args.base_url, args.building_id, args.max_workers[0], args.page_sizes[0],
+                           args.page_workers, args.modes[0])
+        print(json.dumps(result))
+        return
+
+    config = MockConfig(
+        room_token=ROOM_TOKEN,
+        hca_token=HCA_TOKEN,
+        records_per_series=args.records,
+        latency=args.latency,
+        latency_per_1k=args.latency_per_1k,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        replay_dir=args.replay_dir,
+    )
+    server, base_url = start_server(config)
+    print(f"Mock EBZ API on {base_url}, building {args.building_id}, {args.records} records per series")
+    print(" ".join(f"{c:>12}" for c in COLUMNS))
+    results = []
+    try:
+        for mode, max_workers, page_size in itertools.product(args.modes, args.max_workers, args.page_sizes):
+            results.append(run_config(base_url, args.building_id, max_workers, page_size, args.page_workers, mode))
+            print(format_row(results[-1]))
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if any(result["failed"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch throughput benchmark against the mock EBZ API")
+    parser.add_argument("--building_id", type=int, default=10)
+    parser.add_argument("--max_workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--page_sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--page_workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", choices=["memory", "stream"], default=["memory", "stream"])
+    parser.add_argument("--records", type=int, default=20000, help="Temperature records per room / HCA")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    parser.add_argument("--latency_per_1k", type=float, default=0.002, help="Extra seconds per 1000 records")
+    parser.add_argument("--error_rate", type=float, default=0.01)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.01)
+    parser.add_argument("--replay_dir", type=str, default=None, help="Recorded {id}_temperatures.json / {id}_units.json")
+    parser.add_argument("--output", type=str, default=None, help="Write the results as JSON")
+    parser.add_argument("--quick", action="store_true", help="Small offline smoke run, e.g. for CI")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base_url", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.quick:
+        args.max_workers = [1, 8]
+        args.page_sizes = [2000]
+        args.records = 3000
+        args.latency = 0.002
+        args.latency_per_1k = 0.0
+    main(args)
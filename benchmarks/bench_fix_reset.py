@@ -0,0 +1,94 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_qa import fix_reset
+
+# Parity and speed of data_qa.fix_reset (all HCAs in one pass) against the
+# previous groupby.apply version, on daily units of many HCAs with counter
+# resets, missing units, zeros, duplicate days and rows without HCA id.
+#
+#   python -m benchmarks.bench_fix_reset --hcas 5000 --days 365
+
+
+def fix_reset_apply(hca_units: pd.DataFrame) -> pd.DataFrame:
+    """fix_reset before the vectorized version, one Python call per HCA."""
+    hca_units = hca_units.sort_values(
+        ['heat_cost_allocator_id', 'ts']
+    ).copy()
+
+    def _fix(group: pd.DataFrame) -> pd.DataFrame:
+        prev_units = group['units'].shift()
+        is_reset = (group['units'] == 0) & (prev_units > 0)
+        offset = (
+            prev_units
+            .where(is_reset, 0)
+            .cumsum()
+        )
+        group['units'] = group['units'] + offset
+        return group
+
+    return (
+        hca_units
+        .groupby('heat_cost_allocator_id', group_keys=False)
+        .apply(_fix)
+    )
+
+
+def units_frame(hcas: int, days: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2023-01-01", periods=days, freq="D", tz="UTC").as_unit("us")
+    n = hcas * days
+    units = np.cumsum(rng.random((hcas, days)) * 5, axis=1)
+    # up to three counter resets per HCA, the counter restarts from 0
+    for _ in range(3):
+        rows = np.flatnonzero(rng.random(hcas) < 0.5)
+        cut = rng.integers(1, days, size=len(rows))
+        for row, day in zip(rows, cut):
+            units[row, day:] -= units[row, day]
+    df = pd.DataFrame({
+        "heat_cost_allocator_id": np.repeat(np.arange(hcas, dtype=np.int32) + 50000, days),
+        "ts": np.tile(ts, hcas),
+        "units": units.ravel().astype(np.float32),
+        "room_id": np.repeat(rng.integers(0, hcas // 3 + 1, size=hcas).astype(np.int32), days),
+    })
+    df.loc[rng.random(n) < 0.01, "units"] = np.nan
+    df.loc[rng.random(n) < 0.01, "units"] = 0.0
+    # rows in arrival order, a few days twice, a few rows without HCA id
+    df = pd.concat([df, df.sample(n // 100, random_state=seed)]).sample(frac=1, random_state=seed)
+    df["heat_cost_allocator_id"] = df["heat_cost_allocator_id"].astype("Int32")
+    df.loc[df.sample(20, random_state=seed).index, "heat_cost_allocator_id"] = pd.NA
+    return df.reset_index(drop=True)
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def main(args):
+    df = units_frame(args.hcas, args.days, args.seed)
+    print(f"{args.hcas} HCAs, {args.days} days, {len(df)} rows")
+
+    expected, t_apply = timed(lambda: fix_reset_apply(df), 1)
+    result, t_fast = timed(lambda: fix_reset(df), args.repeat)
+    # groupby.apply of pandas 3 leaves out the HCA column, compare the columns it returns
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+    print(f"groupby.apply  {t_apply:7.3f}s")
+    print(f"one pass       {t_fast:7.3f}s   x{t_apply / t_fast:.1f}")
+    print("parity ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fix_reset: one pass over all HCAs vs groupby.apply")
+    parser.add_argument("--hcas", type=int, default=3000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
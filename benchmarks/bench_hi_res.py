@@ -0,0 +1,87 @@
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from metadata_index import MetadataIndex
+from resample import calculate_hi_res_fast, calculate_hi_res_roomwise, precompute_coefficients
+
+# Parity and speed of the heat unit kernels of resample.py on the hourly HCA
+# frame of a real building layout over several years.
+#
+#   python -m benchmarks.bench_hi_res
+#   python -m benchmarks.bench_hi_res --building_id 57 --years 5
+
+
+def hourly_hca_frame(hca_ids, years: int, seed: int = 0) -> pd.DataFrame:
+    """Shape of hca_resample's output after reset_index: gaps, NaNs, heating and idle hours."""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range("2021-01-01", periods=years * 8760, freq="h", tz="UTC").as_unit("us")
+    outside = 10 + 10 * np.sin(np.arange(len(hours)) / 24.0)
+    frames = []
+    for hca in hca_ids:
+        keep = rng.random(len(hours)) > 0.02
+        n = int(keep.sum())
+        t1 = 20 + 2 * rng.standard_normal(n)
+        t2 = t1 + np.where(rng.random(n) > 0.5, 15 * rng.random(n), rng.random(n))
+        t1[rng.random(n) < 0.01] = np.nan
+        frames.append(pd.DataFrame({
+            'heat_cost_allocator_id': hca,
+            'ts': hours[keep],
+            'temperature_1': t1,
+            'temperature_2': t2,
+            'outside_temp': outside[keep],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        # calculate_hi_res_roomwise prints frame heads
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def main(args):
+    index = MetadataIndex.from_csv("metadata")
+    hca_ids = index.hcas_of_building(args.building_id)
+    df = hourly_hca_frame(hca_ids, args.years, args.seed)
+    # one HCA without metadata and a few duplicate rows, both handled by the original
+    extra = df.head(100).assign(heat_cost_allocator_id=-1)
+    df = pd.concat([df, extra, df.sample(50, random_state=args.seed)], ignore_index=True)
+    df_hca = index.coefficients().reset_index()
+    print(f"Building {args.building_id}: {len(hca_ids)} HCAs, {args.years} years, {len(df)} hourly rows")
+
+    expected, t_pandas = timed(lambda: calculate_hi_res_roomwise(df.copy(), df_hca), args.repeat)
+    coefficients, t_pre = timed(lambda: precompute_coefficients(df_hca), 1)
+    result, t_fast = timed(lambda: calculate_hi_res_fast(df, coefficients), args.repeat)
+    result32, t_fast32 = timed(lambda: calculate_hi_res_fast(df, coefficients, dtype=np.float32), args.repeat)
+    # hca_resample hands over rows already sorted by HCA and hour
+    df_sorted = df.sort_values(['heat_cost_allocator_id', 'ts'], kind='stable', ignore_index=True)
+    result_sorted, t_sorted = timed(lambda: calculate_hi_res_fast(df_sorted, coefficients), args.repeat)
+
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(result_sorted, expected, check_exact=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(result32, expected, check_exact=False, check_dtype=False, rtol=1e-3, atol=1e-3)
+    print(f"pandas merge + groupby   {t_pandas:7.3f}s")
+    print(f"precompute coefficients  {t_pre:7.3f}s (once per building)")
+    print(f"fast float64             {t_fast:7.3f}s   x{t_pandas / t_fast:.1f}")
+    print(f"fast float32             {t_fast32:7.3f}s   x{t_pandas / t_fast32:.1f}")
+    print(f"fast float64, sorted in  {t_sorted:7.3f}s   x{t_pandas / t_sorted:.1f}")
+    print("parity ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Heat unit kernel: parity with calculate_hi_res_roomwise and speed")
+    parser.add_argument("--building_id", type=int, default=57)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
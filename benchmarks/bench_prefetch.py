@@ -0,0 +1,85 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from joblib import Parallel, delayed
+
+import dataset_cache
+
+# Wall time of downloading inside each joblib worker (the old get_local_copy
+# pattern) vs dataset_cache.prefetch feeding the workers, with simulated
+# dataset downloads and compute. A second prefetch run is served from the
+# content-addressed cache.
+#
+#   python -m benchmarks.bench_prefetch --datasets 16 --download_s 0.5 --compute_s 0.5
+
+
+class FakeDataset:
+    """Stand-in for clearml.Dataset: get_mutable_local_copy sleeps, then writes one file."""
+
+    def __init__(self, dataset_id: str, download_s: float):
+        self.id = dataset_id
+        self.project = "bench_prefetch"
+        self.name = dataset_id
+        self.download_s = download_s
+
+    def get_mutable_local_copy(self, target_folder: str, overwrite: bool = False):
+        time.sleep(self.download_s)
+        with open(os.path.join(target_folder, "data.csv"), "w") as f:
+            f.write(f"id\n{self.id}\n")
+        return target_folder
+
+
+def compute(path: str, compute_s: float) -> str:
+    with open(os.path.join(path, "data.csv")) as f:
+        value = f.read().split()[-1]
+    time.sleep(compute_s)
+    return value
+
+
+def download_and_compute(dataset, cache_dir: str, compute_s: float) -> str:
+    return compute(dataset_cache.cached_copy(dataset, cache_dir), compute_s)
+
+
+def main(args):
+    root = tempfile.mkdtemp(prefix="bench_prefetch_")
+    try:
+        datasets = {i: FakeDataset(f"dataset-{i}", args.download_s) for i in range(args.datasets)}
+
+        started = time.perf_counter()
+        inline = Parallel(n_jobs=args.n_jobs, backend="threading")(
+            delayed(download_and_compute)(datasets[i], os.path.join(root, "inline"), args.compute_s) for i in datasets
+        )
+        t_inline = time.perf_counter() - started
+
+        def fetch(i):
+            return dataset_cache.cached_copy(datasets[i], os.path.join(root, "prefetch"))
+
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            prefetched = Parallel(n_jobs=args.n_jobs, backend="threading")(
+                delayed(compute)(path, args.compute_s)
+                for _, path in dataset_cache.prefetch(datasets, fetch, max_workers=args.max_workers)
+            )
+            timings.append(time.perf_counter() - started)
+
+        assert sorted(inline) == sorted(prefetched) == sorted(d.id for d in datasets.values())
+        print(f"{args.datasets} datasets, {args.download_s}s download, {args.compute_s}s compute, {args.n_jobs} workers")
+        print(f"download in worker   {t_inline:6.2f}s")
+        print(f"prefetch             {timings[0]:6.2f}s   x{t_inline / timings[0]:.1f}")
+        print(f"prefetch, cached     {timings[1]:6.2f}s   x{t_inline / timings[1]:.1f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dataset downloads inside the workers vs prefetched")
+    parser.add_argument("--datasets", type=int, default=16)
+    parser.add_argument("--download_s", type=float, default=0.5)
+    parser.add_argument("--compute_s", type=float, default=0.5)
+    parser.add_argument("--n_jobs", type=int, default=4)
+    parser.add_argument("--max_workers", type=int, default=4, help="Concurrent prefetch downloads")
+    main(parser.parse_args())
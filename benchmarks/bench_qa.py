@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_qa import df_qa
+from resample import OUTPUT_COLUMNS
+
+# Parity and speed of the numpy QA engine of data_qa.df_qa against the
+# per-room / per-variable loops (engine="pandas") on a synthetic resampled
+# table with gaps of every length, zeros and rooms without units.
+#
+#   python -m benchmarks.bench_qa --rooms 300 --days 180
+
+
+def resampled_frame(rooms: int, days: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frames = []
+    for room in range(rooms):
+        # rooms cover different stretches of time
+        hours = pd.date_range("2023-01-01", periods=int(days * 24 * rng.uniform(0.3, 1.0)), freq="h", tz="UTC")
+        n = len(hours)
+        df = pd.DataFrame({"room_id": np.int32(1000 + room), "ts": hours})
+        for col in OUTPUT_COLUMNS[2:-1]:
+            values = np.round(20 + 5 * rng.standard_normal(n), 2)
+            # gaps: mostly short, some longer than 12 hours, some multi-day value runs in between
+            for _ in range(rng.integers(0, 40)):
+                start = rng.integers(0, n)
+                values[start:start + int(rng.choice([1, 2, 3, 5, 8, 12, 13, 30, 200]))] = np.nan
+            values[rng.random(n) < 0.05] = 0.0
+            df[col] = values.astype(np.float32)
+        df["building_id"] = np.int32(1)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def units_frame(resampled: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    rooms = resampled["room_id"].unique()
+    # every third room has no units
+    rooms = rooms[np.arange(len(rooms)) % 3 != 0]
+    days = pd.date_range("2023-01-01", periods=int(resampled["ts"].dt.normalize().nunique()), freq="D", tz="UTC")
+    frames = []
+    for i, room in enumerate(rooms):
+        units = np.cumsum(rng.random(len(days)) * 5)
+        units[len(days) // 2:] -= units[len(days) // 2]  # a counter reset
+        frames.append(pd.DataFrame({"heat_cost_allocator_id": np.int32(50000 + i), "ts": days,
+                                    "units": units.astype(np.float32), "room_id": room}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn()
+    return result, time.perf_counter() - started
+
+
+def main(args):
+    resampled = resampled_frame(args.rooms, args.days, args.seed)
+    hca_units = units_frame(resampled, args.seed)
+    print(f"{args.rooms} rooms, {len(resampled)} hourly rows, {len(hca_units)} units rows")
+
+    # without units only the run-length part runs, the upsampling error is NaN everywhere
+    no_units = hca_units.iloc[:0]
+    for name, units in [("runs only", no_units), ("with units", hca_units)]:
+        expected, t_pandas = timed(lambda: df_qa(resampled, units, engine="pandas"))
+        result, t_numpy = timed(lambda: df_qa(resampled, units, engine="numpy"))
+        # the numpy engine keeps room_id in the int32 of the schema, the loops widen it to int64
+        pd.testing.assert_frame_equal(result, expected, check_index_type=False)
+        print(f"{name:>10}: pandas {t_pandas:7.2f}s   numpy {t_numpy:7.2f}s   x{t_pandas / t_numpy:.1f}")
+    print("parity ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="df_qa: numpy run-length engine vs per-room loops")
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from hourly import hourly_mean
+
+# Parity and speed of the hourly binning engines used by resample.py.
+#
+#   python -m benchmarks.bench_resample
+#   python -m benchmarks.bench_resample --series 500 --days 365
+
+
+def synthetic_series(n_series: int, days: int, id_col: str, columns: list, seed: int = 0) -> pd.DataFrame:
+    """10 minute samples with jitter, gaps of several hours, NaNs and shuffled rows."""
+    rng = np.random.default_rng(seed)
+    n = days * 144
+    frames = []
+    for series_id in rng.choice(100000, size=n_series, replace=False):
+        start = pd.Timestamp("2023-01-01", tz="UTC") + pd.Timedelta(minutes=int(rng.integers(0, 7 * 1440)))
+        offsets = np.arange(n) * 600 + rng.integers(0, 120, size=n)
+        keep = rng.random(n) > 0.05
+        # a few multi-hour outages
+        for gap in rng.integers(0, n, size=3):
+            keep[gap:gap + int(rng.integers(6, 60))] = False
+        df = pd.DataFrame({
+            id_col: series_id,
+            'ts': start + pd.to_timedelta(offsets[keep], unit="s"),
+        })
+        for column in columns:
+            values = 20 + 5 * rng.standard_normal(len(df))
+            values[rng.random(len(df)) < 0.02] = np.nan
+            df[column] = values
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def check(df: pd.DataFrame, id_col: str, columns: list, repeat: int):
+    expected, t_pandas = timed(lambda: hourly_mean(df, id_col, columns, engine="pandas"), repeat)
+    result, t_numpy = timed(lambda: hourly_mean(df, id_col, columns, engine="numpy"), repeat)
+    # means are summed in a different order, values agree to rounding
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-12, atol=1e-12)
+    print(f"{id_col:>24} {len(df):>10} rows {len(expected):>9} hours   pandas {t_pandas:7.3f}s   "
+          f"numpy {t_numpy:7.3f}s   x{t_pandas / t_numpy:.1f}")
+
+
+def main(args):
+    rooms = synthetic_series(args.series, args.days, 'room_id', ['temperature'], seed=args.seed)
+    hcas = synthetic_series(args.series, args.days, 'heat_cost_allocator_id', ['temperature_1', 'temperature_2'], seed=args.seed + 1)
+    check(rooms, 'room_id', ['temperature'], args.repeat)
+    check(hcas, 'heat_cost_allocator_id', ['temperature_1', 'temperature_2'], args.repeat)
+
+    # edge cases: single sample, naive timestamps, only NaNs in a series
+    edge = rooms.head(1000).copy()
+    edge.loc[edge['room_id'] == edge['room_id'].iloc[0], 'temperature'] = np.nan
+    check(edge, 'room_id', ['temperature'], 1)
+    check(rooms.head(1), 'room_id', ['temperature'], 1)
+    check(rooms.head(1000).assign(ts=lambda d: d['ts'].dt.tz_localize(None)), 'room_id', ['temperature'], 1)
+    check(rooms.head(1000).assign(ts=lambda d: d['ts'].dt.as_unit('ns')), 'room_id', ['temperature'], 1)
+    print("parity ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hourly binning engines: parity with pandas and speed")
+    parser.add_argument("--series", type=int, default=200, help="Rooms / HCAs")
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Peak memory and parity of resample.main (whole building in memory) and
+# resample.main_chunked (room by room) on a synthetic building laid out like
+# a Building dataset copy. Weather and coordinates are seeded into a private
+# geo cache, so the run is offline. Each mode runs in its own process.
+#
+#   python -m benchmarks.bench_resample_chunked --building_id 57 --days 365
+
+CACHE_DIR_NAME = "cache"
+
+
+def write_building(root: str, building_id: int, days: int, seed: int = 0):
+    from metadata_index import MetadataIndex
+
+    for name in ["building_metadata.csv", "rooms_metadata.csv", "hca_metadata.csv"]:
+        shutil.copy(os.path.join("metadata", name), root)
+    index = MetadataIndex.from_csv(root)
+    building_path = os.path.join(root, f"building-{building_id}")
+    os.makedirs(building_path, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2023-01-01", tz="UTC")
+    n = days * 144
+
+    def series(id_col, series_id, columns):
+        offsets = np.arange(n) * 600 + rng.integers(0, 120, size=n)
+        keep = rng.random(n) > 0.05
+        ts = (start + pd.to_timedelta(offsets[keep], unit="s")).strftime("%Y-%m-%dT%H:%M:%SZ")
+        df = pd.DataFrame({id_col: series_id, "ts": ts})
+        for column in columns:
+            df[column] = np.round(20 + 5 * rng.standard_normal(len(df)), 2)
+        return df
+
+    rooms = index.rooms_of_building(building_id)
+    # write series by series so generating the input does not need the memory under test
+    header = True
+    for room in rooms:
+        series("room_id", room, ["temperature"]).to_csv(os.path.join(building_path, "room_temp_ts.csv"),
+                                                        mode="a", header=header, index=False)
+        header = False
+    header = True
+    for hca in index.hcas_of_building(building_id):
+        df = series("heat_cost_allocator_id", hca, ["temperature_1", "temperature_2"])
+        df["temperature_2"] += 10 * rng.random(len(df))
+        df.to_csv(os.path.join(building_path, "allocator_ts.csv"), mode="a", header=header, index=False)
+        header = False
+    return index
+
+
+def seed_geo_cache(index, building_id: int, days: int):
+    import geo_cache
+
+    city = index.city(building_id)
+    geo_cache.cached_coordinates([city], lambda _: (51.0, 7.0))
+
+    def fetch(latitude, longitude, start, end):
+        ts = pd.date_range(start, end, freq="h", tz="UTC")
+        return pd.DataFrame({"ts": ts, "outside_temp": np.sin(np.arange(len(ts)) / 24.0) * 10})
+
+    geo_cache.cached_hourly_temperature(51.0, 7.0, pd.Timestamp("2023-01-01"),
+                                        pd.Timestamp("2023-01-01") + pd.Timedelta(days=days + 1), fetch)
+
+
+def run_child(root: str, building_id: int, mode: str, output_file: str) -> dict:
+    import resample
+
+    started = time.perf_counter()
+    if mode == "chunked":
+        resample.main_chunked(building_id, output_file, local_path=root)
+    else:
+        resample.main(building_id, local_path=root).to_csv(output_file, index=False)
+    return {
+        "mode": mode,
+        "elapsed_s": time.perf_counter() - started,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_mode(root: str, building_id: int, mode: str, output_file: str) -> dict:
+    cmd = [sys.executable, "-m", "benchmarks.bench_resample_chunked", "--child", mode,
+           "--root", root, "--output_file", output_file, "--building_id", str(building_id)]
+    env = dict(os.environ, API_FETCH_CACHE_DIR=os.path.join(root, CACHE_DIR_NAME))
+    out = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if out.returncode:
+        raise RuntimeError(f"{mode} run failed:\n{out.stderr[-3000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    if args.child:
+        print(json.dumps(run_child(args.root, args.building_id, args.child, args.output_file)))
+        return
+
+    root = tempfile.mkdtemp(prefix="bench_resample_")
+    try:
+        os.environ["API_FETCH_CACHE_DIR"] = os.path.join(root, CACHE_DIR_NAME)
+        index = write_building(root, args.building_id, args.days, args.seed)
+        seed_geo_cache(index, args.building_id, args.days)
+        size = sum(os.path.getsize(os.path.join(root, f"building-{args.building_id}", f)) for f in
+                   ["room_temp_ts.csv", "allocator_ts.csv"])
+        print(f"Building {args.building_id}: {len(index.rooms_of_building(args.building_id))} rooms, "
+              f"{len(index.hcas_of_building(args.building_id))} HCAs, {args.days} days, {size / 1e6:.0f} MB of CSV")
+
+        results = {}
+        for mode in ["memory", "chunked"]:
+            results[mode] = run_mode(root, args.building_id, mode, os.path.join(root, f"{mode}.csv"))
+            print(f"{mode:>8}: {results[mode]['elapsed_s']:7.1f}s  peak RSS {results[mode]['peak_rss_mb']:8.0f} MB")
+
+        import schema
+
+        expected = schema.apply(pd.read_csv(os.path.join(root, "memory.csv")))
+        result = schema.apply(pd.read_csv(os.path.join(root, "chunked.csv")))
+        pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9)
+        print("parity ok")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory of in-memory vs room-by-room resampling")
+    parser.add_argument("--building_id", type=int, default=10)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", choices=["memory", "chunked"], default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--root", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output_file", type=str, default=None, help=argparse.SUPPRESS)
+    main(parser.parse_args())
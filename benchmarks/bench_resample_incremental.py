@@ -0,0 +1,172 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_resample_chunked import CACHE_DIR_NAME, seed_geo_cache, write_building
+
+# Parity and cost of resample.main_incremental against a full resample.main
+# after one more day of raw data. Some series have gaps across the cut, one
+# room has no earlier data, to exercise the overlap handling, one HCA lags
+# behind in the earlier snapshot and one stopped reporting long ago.
+# resample_partition, as the pipeline calls it, only takes the incremental
+# path on Parquet raw tables and resamples CSV tables in full.
+#
+#   python -m benchmarks.bench_resample_incremental --building_id 10 --days 90
+#   python -m benchmarks.bench_resample_incremental --parquet
+
+
+def truncate_building(source: str, target: str, building_id: int, cut: pd.Timestamp, lagging: dict = None):
+    """
+    Copy of the building at `source` with only the raw samples before `cut`,
+    for the series in `lagging` ({table: [ids]}) only those two days before.
+    """
+    import storage
+
+    shutil.copytree(source, target, ignore=shutil.ignore_patterns(CACHE_DIR_NAME))
+    for table in ["room_temp_ts", "allocator_ts"]:
+        path = os.path.join(target, f"building-{building_id}", f"{table}.csv")
+        df = pd.read_csv(path)
+        series_cut = np.where(df[storage.SERIES_ID[table]].isin((lagging or {}).get(table, [])), cut - pd.Timedelta(days=2), cut)
+        df[pd.to_datetime(df["ts"], utc=True) < series_cut].to_csv(path, index=False)
+
+
+def stop_series(root: str, building_id: int, table: str, series_id: int, end: pd.Timestamp):
+    """Drops the samples of one series from `end` on: it stopped reporting then."""
+    import storage
+
+    path = os.path.join(root, f"building-{building_id}", f"{table}.csv")
+    df = pd.read_csv(path)
+    df[(df[storage.SERIES_ID[table]] != series_id) | (pd.to_datetime(df["ts"], utc=True) < end)].to_csv(path, index=False)
+
+
+def reporting(root: str, building_id: int, table: str, start: pd.Timestamp, end: pd.Timestamp) -> set:
+    """Ids of the series with samples from `start` to before `end`."""
+    import storage
+
+    df = pd.read_csv(os.path.join(root, f"building-{building_id}", f"{table}.csv"))
+    ts = pd.to_datetime(df["ts"], utc=True)
+    return set(df.loc[(ts >= start) & (ts < end), storage.SERIES_ID[table]])
+
+
+def fetch_state(root: str, building_id: int) -> dict:
+    """The fetch state cml_dataset would have stored with the raw tables at `root`."""
+    from cml_dataset import update_fetch_state
+
+    building_path = os.path.join(root, f"building-{building_id}")
+    state = None
+    for table, key, id_col in [("room_temp_ts", "rooms", "room_id"), ("allocator_ts", "hcas", "heat_cost_allocator_id")]:
+        state = update_fetch_state(state, pd.read_csv(os.path.join(building_path, f"{table}.csv")), key, id_col)
+    return state
+
+
+def add_gaps(root: str, building_id: int, cut: pd.Timestamp, seed: int):
+    """Gaps across `cut`, longer than resample.OVERLAP_WINDOW, and one room that only starts after it."""
+    import storage
+
+    rng = np.random.default_rng(seed)
+    for table in ["room_temp_ts", "allocator_ts"]:
+        path = os.path.join(root, f"building-{building_id}", f"{table}.csv")
+        df = pd.read_csv(path)
+        id_col = storage.SERIES_ID[table]
+        ts = pd.to_datetime(df["ts"], utc=True)
+        ids = df[id_col].unique()
+        gapped = rng.choice(ids, size=max(1, len(ids) // 10), replace=False)
+        drop = df[id_col].isin(gapped) & (ts >= cut - pd.Timedelta(days=3)) & (ts < cut + pd.Timedelta(hours=5))
+        if table == "room_temp_ts":
+            drop |= (df[id_col] == ids[0]) & (ts < cut)
+        df[~drop].to_csv(path, index=False)
+
+
+def to_parquet(root: str, building_id: int):
+    import storage
+
+    building_path = os.path.join(root, f"building-{building_id}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for table in ["room_temp_ts", "allocator_ts"]:
+            storage.spill_table(building_path, table, tmp_dir, building_id)
+            os.remove(os.path.join(building_path, f"{table}.csv"))
+            shutil.move(os.path.join(tmp_dir, table), os.path.join(building_path, table))
+
+
+def timed(fn):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn()
+    return result, time.perf_counter() - started
+
+
+def main(args):
+    root = tempfile.mkdtemp(prefix="bench_incremental_")
+    try:
+        os.environ["API_FETCH_CACHE_DIR"] = os.path.join(root, CACHE_DIR_NAME)
+        import resample
+        import storage
+        from cml_dataset import save_fetch_state
+
+        full_root = os.path.join(root, "full")
+        previous_root = os.path.join(root, "previous")
+        os.makedirs(full_root)
+        index = write_building(full_root, args.building_id, args.days, args.seed)
+        seed_geo_cache(index, args.building_id, args.days)
+        # the last day is new, cut in the middle of an hour
+        cut = pd.Timestamp("2023-01-01", tz="UTC") + pd.Timedelta(days=args.days - 1, hours=13, minutes=25)
+        add_gaps(full_root, args.building_id, cut, args.seed)
+        # the lagging HCA has all coefficients (the others have no heat units to get wrong), and it and
+        # its room report up to the cut, so the room's last earlier hour is after the HCA's last sample
+        coefficients = index.coefficients().dropna()
+        lag_start = cut - pd.Timedelta(days=2)
+        rooms_up = reporting(full_root, args.building_id, "room_temp_ts", lag_start, cut)
+        hcas_up = reporting(full_root, args.building_id, "allocator_ts", lag_start, cut)
+        hcas = [hca for hca in index.hcas_of_building(args.building_id)
+                if hca in coefficients.index and hca in hcas_up and coefficients.loc[hca, "room_id"] in rooms_up]
+        stop_series(full_root, args.building_id, "allocator_ts", hcas[-1], cut - pd.Timedelta(days=args.days // 2))
+        truncate_building(full_root, previous_root, args.building_id, cut, lagging={"allocator_ts": [hcas[0]]})
+        previous_state = fetch_state(previous_root, args.building_id)
+        # stored with the Building dataset, main_incremental reads it from the copy
+        save_fetch_state(fetch_state(full_root, args.building_id), os.path.join(full_root, f"building-{args.building_id}"))
+        if args.parquet:
+            to_parquet(full_root, args.building_id)
+
+        previous, _ = timed(lambda: resample.main(args.building_id, local_path=previous_root))
+        previous = previous.reindex(columns=resample.OUTPUT_COLUMNS)
+        expected, t_full = timed(lambda: resample.main(args.building_id, local_path=full_root))
+        result, t_incremental = timed(lambda: resample.main_incremental(args.building_id, previous, previous_state,
+                                                                        local_path=full_root))
+
+        previous_path = os.path.join(root, "resampled_previous")
+        with storage.PartitionPageWriter(previous_path, args.building_id) as writer:
+            writer.write(previous)
+        output_dir = os.path.join(root, "resampled")
+        _, t_partition = timed(lambda: resample.resample_partition(args.building_id, output_dir, previous_path=previous_path,
+                                                                  local_path=full_root, previous_state=previous_state))
+        partition = storage.load_resampled(output_dir, building_ids=[args.building_id])
+
+        expected = expected.reindex(columns=resample.OUTPUT_COLUMNS).sort_values(["room_id", "ts"], ignore_index=True)
+        pd.testing.assert_frame_equal(result, expected, check_exact=False, check_dtype=False, rtol=1e-9)
+        partition = partition.reindex(columns=resample.OUTPUT_COLUMNS).sort_values(["room_id", "ts"], ignore_index=True)
+        pd.testing.assert_frame_equal(partition, expected, check_exact=False, check_dtype=False, rtol=1e-9)
+        print(f"Building {args.building_id}: {args.days} days, {len(expected)} hourly rows, "
+              f"{'Parquet' if args.parquet else 'CSV'} raw tables")
+        print(f"full        {t_full:7.2f}s")
+        print(f"incremental {t_incremental:7.2f}s   x{t_full / t_incremental:.1f}")
+        print(f"partition   {t_partition:7.2f}s   x{t_full / t_partition:.1f}   (resample_partition, "
+              f"{'incremental' if args.parquet else 'full on CSV'})")
+        print("parity ok")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental vs full resampling after one new day of data")
+    parser.add_argument("--building_id", type=int, default=10)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parquet", action="store_true", help="Store the raw tables as Parquet partitions")
+    main(parser.parse_args())
@@ -0,0 +1,68 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import schema
+from resample import OUTPUT_COLUMNS
+
+# Memory of the combined multi-building resampled frame and of a raw HCA
+# table in the previous types (int64 ids, float64 values, string ts for raw
+# data) vs the compact pipeline schema.
+#
+#   python -m benchmarks.bench_schema --buildings 27 --rooms 40 --days 365
+
+
+def resampled_frame(buildings: int, rooms: int, days: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range("2023-01-01", periods=days * 24, freq="h", tz="UTC").as_unit("us")
+    n = buildings * rooms * len(hours)
+    room_ids = np.arange(buildings * rooms, dtype=np.int64)
+    df = pd.DataFrame({
+        "room_id": np.repeat(room_ids, len(hours)),
+        "ts": np.tile(hours, buildings * rooms),
+    })
+    for col in OUTPUT_COLUMNS[2:-1]:
+        df[col] = np.round(20 + 5 * rng.standard_normal(n), 2)
+    df["building_id"] = np.repeat(np.arange(buildings, dtype=np.int64), rooms * len(hours))
+    return df
+
+
+def raw_frame(hcas: int, days: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2023-01-01", periods=days * 144, freq="10min", tz="UTC")
+    n = hcas * len(ts)
+    return pd.DataFrame({
+        "heat_cost_allocator_id": np.repeat(np.arange(hcas, dtype=np.int64), len(ts)),
+        "ts": np.tile(np.asarray(ts.strftime("%Y-%m-%dT%H:%M:%SZ"), dtype=object), hcas),
+        "temperature_1": np.round(20 + rng.standard_normal(n), 2),
+        "temperature_2": np.round(30 + rng.standard_normal(n), 2),
+    })
+
+
+def mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def main(args):
+    combined = resampled_frame(args.buildings, args.rooms, args.days, args.seed)
+    compact = schema.apply(combined)
+    pd.testing.assert_frame_equal(compact, combined, check_dtype=False, rtol=1e-6)
+    print(f"resampled, {args.buildings} buildings x {args.rooms} rooms x {args.days} days: "
+          f"{mb(combined):8.0f} MB -> {mb(compact):8.0f} MB   x{mb(compact) / mb(combined):.2f}")
+
+    raw = raw_frame(args.hcas, args.raw_days, args.seed)
+    compact = schema.apply(raw)
+    print(f"raw HCA table, {args.hcas} HCAs x {args.raw_days} days:        "
+          f"{mb(raw):8.0f} MB -> {mb(compact):8.0f} MB   x{mb(compact) / mb(raw):.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory of the compact pipeline schema")
+    parser.add_argument("--buildings", type=int, default=27)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--hcas", type=int, default=100)
+    parser.add_argument("--raw_days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
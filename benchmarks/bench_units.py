@@ -0,0 +1,103 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+# Units aggregation of resample.fetch_units_remote on synthetic units_ts.csv
+# files of real building layouts: per-building metadata merge + concat (the
+# previous fetch_units) vs the shared memory-mapped join table, in memory
+# and written to per-building partitions. Checks that all three agree.
+#
+#   python -m benchmarks.bench_units --buildings 10 18 21 57 --days 365
+
+
+def write_units(root: str, building_ids, days: int, seed: int = 0):
+    from metadata_index import MetadataIndex
+
+    for name in ["building_metadata.csv", "rooms_metadata.csv", "hca_metadata.csv"]:
+        shutil.copy(os.path.join("metadata", name), root)
+    index = MetadataIndex.from_csv(root)
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range("2023-01-01", periods=days, freq="D", tz="UTC").strftime("%Y-%m-%dT%H:%M:%SZ")
+    for building_id in building_ids:
+        hcas = index.hcas_of_building(building_id)
+        # plus one HCA without metadata, dropped by the inner join
+        hcas = np.append(hcas, 10 ** 6)
+        df = pd.DataFrame({
+            "heat_cost_allocator_id": np.repeat(hcas, len(ts)),
+            "ts": np.tile(np.asarray(ts, dtype=object), len(hcas)),
+            "units": np.round(np.cumsum(rng.random(len(hcas) * len(ts))), 1),
+        })
+        os.makedirs(os.path.join(root, f"building-{building_id}"), exist_ok=True)
+        # written like cml_dataset does: no index column
+        df.to_csv(os.path.join(root, f"building-{building_id}", "units_ts.csv"), index=False)
+
+
+def fetch_units_merge(path: str, building_id: int) -> pd.DataFrame:
+    """fetch_units before the shared join table: metadata merge in every call."""
+    import schema
+    import storage
+    from metadata_index import MetadataIndex
+
+    df_units = storage.read_csv(f"{path}/building-{building_id}/units_ts.csv", index_col=0)
+    metadata = MetadataIndex.from_csv(path).hca_table()[['heat_cost_allocator_id', 'room_id', 'building_id']]
+    return schema.apply(schema.apply(df_units).merge(metadata, on='heat_cost_allocator_id', how='inner'))
+
+
+def main(args):
+    root = tempfile.mkdtemp(prefix="bench_units_")
+    try:
+        os.environ["API_FETCH_CACHE_DIR"] = os.path.join(root, "cache")
+        import resample
+        import storage
+        from metadata_index import hca_lookup_file
+
+        write_units(root, args.buildings, args.days, args.seed)
+        # start the worker processes outside the timings
+        Parallel(n_jobs=args.n_jobs)(delayed(len)(b) for b in ["warm", "up"] * args.n_jobs)
+
+        started = time.perf_counter()
+        res = Parallel(n_jobs=args.n_jobs)(delayed(fetch_units_merge)(root, b) for b in args.buildings)
+        expected = pd.concat(res, ignore_index=True)
+        t_merge = time.perf_counter() - started
+
+        started = time.perf_counter()
+        lookup_file = hca_lookup_file(root)
+        res = Parallel(n_jobs=args.n_jobs)(delayed(resample.fetch_units)(root, b, lookup_file) for b in args.buildings)
+        result = pd.concat(res, ignore_index=True)
+        t_lookup = time.perf_counter() - started
+
+        output_dir = os.path.join(root, "out")
+        started = time.perf_counter()
+        manifests = Parallel(n_jobs=args.n_jobs)(
+            delayed(resample.units_partition)(root, b, output_dir, lookup_file) for b in args.buildings
+        )
+        t_partitioned = time.perf_counter() - started
+
+        pd.testing.assert_frame_equal(result, expected)
+        partitioned = storage.load_units(output_dir).sort_values(["building_id", "heat_cost_allocator_id", "ts"], ignore_index=True)
+        expected = expected.sort_values(["building_id", "heat_cost_allocator_id", "ts"], ignore_index=True)
+        pd.testing.assert_frame_equal(partitioned, expected[partitioned.columns])
+        assert sum(m["rows"] for m in manifests) == len(expected)
+
+        print(f"{len(args.buildings)} buildings, {len(expected)} joined units rows")
+        print(f"merge per building + concat   {t_merge:6.2f}s")
+        print(f"shared join table + concat    {t_lookup:6.2f}s")
+        print(f"shared join table, partitions {t_partitioned:6.2f}s")
+        print("parity ok")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Units join: per-building metadata merge vs shared join table")
+    parser.add_argument("--buildings", type=int, nargs="+", default=[4, 10, 18, 21, 39, 57])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--n_jobs", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
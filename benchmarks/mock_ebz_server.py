@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from datetime import datetime, timedelta, timezone
+
+# Local stand-in for the EBZ /{id}/temperatures and /{id}/units endpoints.
+# Rooms and HCAs share the URL space and are told apart by the token, like
+# on the real API. Payloads are synthetic (generated per page, so huge series
+# cost no memory) or replayed from recorded JSON files.
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+STEP = timedelta(minutes=10)
+
+
+@dataclass
+class MockConfig:
+    room_token: str = "mock-room"
+    hca_token: str = "mock-hca"
+    records_per_series: int = 5000
+    units_per_series: int = 365
+    latency: float = 0.02           # seconds per request
+    latency_per_1k: float = 0.0     # extra seconds per 1000 records sent
+    error_rate: float = 0.0         # share of requests answered with a 503
+    rate_limit_rate: float = 0.0    # share of requests answered with a 429
+    max_per_page: int = 500000      # server side cap of per_page
+    replay_dir: str = None          # {id}_temperatures.json / {id}_units.json
+    seed: int = 0
+
+
+def _iso(ts: datetime) -> str:
+    return ts.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def synthetic_temperatures(series_id: int, is_hca: bool, start: int, stop: int) -> list:
+    records = []
+    for i in range(start, stop):
+        ts = _iso(START + i * STEP)
+        phase = (i % 144) / 144.0
+        if is_hca:
+            records.append({
+                "heat_cost_allocator_id": series_id,
+                "ts": ts,
+                "temperature_1": round(20.0 + 2.0 * phase, 2),
+                "temperature_2": round(25.0 + 20.0 * phase, 2),
+            })
+        else:
+            records.append({"room_id": series_id, "ts": ts, "temperature": round(19.0 + 3.0 * phase, 2)})
+    return records
+
+
+def synthetic_units(series_id: int, n: int) -> list:
+    return [
+        {"heat_cost_allocator_id": series_id, "ts": _iso(START + timedelta(days=i)), "units": float(i % 120)}
+        for i in range(n)
+    ]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    config = MockConfig()
+    requests_served = 0
+    _lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _replay(self, series_id: int, endpoint: str):
+        path = os.path.join(self.config.replay_dir, f"{series_id}_{endpoint}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return data.get("data", data) if isinstance(data, dict) else data
+
+    def do_GET(self):
+        config = self.config
+        with self._lock:
+            type(self).requests_served += 1
+            rng = random.Random(config.seed + self.requests_served)
+
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        token = self.headers.get("Authorization")
+        if len(parts) < 2 or not parts[-2].isdigit() or token not in (config.room_token, config.hca_token):
+            return self._send(401 if token not in (config.room_token, config.hca_token) else 404, {"error": "not found"})
+        series_id, endpoint = int(parts[-2]), parts[-1]
+        is_hca = token == config.hca_token
+
+        time.sleep(config.latency)
+        draw = rng.random()
+        if draw < config.rate_limit_rate:
+            return self._send(429, {"error": "rate limited"}, {"Retry-After": "0"})
+        if draw < config.rate_limit_rate + config.error_rate:
+            return self._send(503, {"error": "unavailable"})
+
+        if endpoint == "units":
+            records = self._replay(series_id, "units") if config.replay_dir else None
+            if records is None:
+                records = synthetic_units(series_id, config.units_per_series)
+            return self._send(200, self._since(records, query))
+        if endpoint != "temperatures":
+            return self._send(404, {"error": "unknown endpoint"})
+
+        per_page = min(int(query.get("per_page", 100)), config.max_per_page)
+        page = max(int(query.get("page", 1)), 1)
+        first, last = (page - 1) * per_page, page * per_page
+
+        replayed = self._replay(series_id, "temperatures") if config.replay_dir else None
+        if replayed is not None:
+            replayed = self._since(replayed, query)
+            total = len(replayed)
+            data = replayed[first:last]
+        else:
+            offset = self._since_offset(query)
+            total = max(config.records_per_series - offset, 0)
+            data = synthetic_temperatures(series_id, is_hca, offset + min(first, total), offset + min(last, total))
+        time.sleep(config.latency_per_1k * len(data) / 1000)
+
+        if is_hca:
+            return self._send(200, data)
+        num_pages = max(-(-total // per_page), 1)
+        return self._send(200, {"data": data, "page": page, "num_pages": num_pages, "per_page": per_page})
+
+    @staticmethod
+    def _since(records: list, query: dict) -> list:
+        if "from" not in query:
+            return records
+        return [r for r in records if r.get("ts", "") >= query["from"]]
+
+    @staticmethod
+    def _since_offset(query: dict) -> int:
+        if "from" not in query:
+            return 0
+        since = datetime.fromisoformat(query["from"]).replace(tzinfo=timezone.utc)
+        return max(-(-(since - START) // STEP), 0)
+
+
+def start_server(config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """Serves in a daemon thread; returns (server, base_url)."""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig(), "requests_served": 0})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/public"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock EBZ API for local runs of cml_dataset.py (set EBZ_BASE_URL)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--records", type=int, default=5000, help="Temperature records per room / HCA")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    parser.add_argument("--latency_per_1k", type=float, default=0.0, help="Extra seconds per 1000 records")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--max_per_page", type=int, default=500000)
+    parser.add_argument("--replay_dir", type=str, default=None)
+    parser.add_argument("--room_token", type=str, default="mock-room")
+    parser.add_argument("--hca_token", type=str, default="mock-hca")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        room_token=args.room_token,
+        hca_token=args.hca_token,
+        records_per_series=args.records,
+        latency=args.latency,
+        latency_per_1k=args.latency_per_1k,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_per_page=args.max_per_page,
+        replay_dir=args.replay_dir,
+    )
+    server, base_url = start_server(config, host="0.0.0.0", port=args.port)
+    print(f"Mock EBZ API on {base_url} (room token {config.room_token!r}, hca token {config.hca_token!r})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
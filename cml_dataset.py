@@ -1,10 +1,24 @@
 from clearml import Dataset, Task
-import requests
 from dotenv import load_dotenv, find_dotenv
 import os 
 import pandas as pd
 import argparse
 import pprint
+import json
+import gzip
+import shutil
+import sys
+import threading
+import traceback
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import decode
+import ebz_client
+import schema
+import storage
+from fetch_metrics import report_to_clearml
+from metadata_index import load_index
 
 # Initialize ClearML Task
 
@@ -12,28 +26,26 @@ import pprint
 load_dotenv(find_dotenv())
 
 
-# Your token reading code (which you confirmed is correct)
-
-
+dataset_project: str = "ForeSightNEXT/BaltBest"
+dataset_name: str = "BaltBestMetadata"
+baseurl = os.environ.get("EBZ_BASE_URL", "https://edc.e-b-z.de/public")
 
-building_token = os.environ['buildings_token']
-hca_token = os.environ['hca_token']
-room_token = os.environ['rooms_token']
-units_token = os.environ['units_token']
-hca_details_token = os.environ['hca_details_token']
-room_details_token = os.environ['room_details_token']
+# page size of the skip-unchanged probes, comfortably more than a day of records
+PROBE_PAGE_SIZE = 1000
 
-if building_token is None:
-    print("FATAL: buildings_token was not found in the environment!")
+# per_page is learned separately for the two temperature endpoints
+room_page_sizer = ebz_client.PageSizer()
+hca_page_sizer = ebz_client.PageSizer()
 
-hca_metadata = pd.read_csv("metadata/hca_metadata.csv")
-room_meta_data = pd.read_csv("metadata/rooms_metadata.csv")
 
-dataset_project: str = "ForeSightNEXT/BaltBest"
-dataset_name: str = "BaltBestMetadata"
-baseurl = "https://edc.e-b-z.de/public"
 
 
+def get_token(name:str) -> str:
+    # read on first use so importing this module needs no credentials
+    token = os.environ.get(name)
+    if token is None:
+        raise RuntimeError(f"FATAL: {name} was not found in the environment!")
+    return token
 
 
 def create_meta_dataset():
@@ -47,79 +59,247 @@ def create_meta_dataset():
     dataset.upload()
     dataset.finalize()
 
-def create_building_dataset(building_id, output_dir):
+def create_building_dataset(building_id, output_dir, previous_dataset=None, fingerprint=None):
     #output_dir = f"./{building_id}/"
-    parent_dataset = Dataset.get(
-        dataset_project=dataset_project,
-        dataset_name=dataset_name,
-        dataset_version="0.0.1",
-    )
+    # every run, full or incremental, publishes the next version, so the
+    # highest version is the newest (see latest_building_dataset)
+    latest = latest_building_dataset(building_id, only_completed=False)
+    dataset_version = bump_version(latest.version) if latest is not None else "0.0.1"
+    if previous_dataset is None:
+        parent_dataset = get_metadata_dataset()
+    else:
+        # incremental run: new version on top of the last building dataset
+        parent_dataset = previous_dataset
     dataset = Dataset.create(
         dataset_project=dataset_project,
         dataset_name=f"Building-{building_id}",
         dataset_tags=["test"],
-        dataset_version="0.0.1",
+        dataset_version=dataset_version,
         parent_datasets=[parent_dataset],
     )
     dataset.add_files(path=output_dir, dataset_path=f"building-{str(building_id)}")
+    if fingerprint is not None:
+        dataset.set_metadata(fingerprint, metadata_name="fingerprint", ui_visible=False)
     dataset.upload()
     dataset.finalize()
 
-def fetch_room_temps(room_id: int, room_details_token: str):
-    all_data = []
-    page = 1
+@lru_cache(maxsize=None)
+def get_metadata_dataset():
+    # looked up once per process, shared by all buildings of a batch
+    return Dataset.get(
+        dataset_project=dataset_project,
+        dataset_name=dataset_name,
+        dataset_version="0.0.1",
+    )
 
-    while True:
-        print(f"Fetching room {room_id}, page {page}")
+def bump_version(version:str):
+    major, minor, patch = (version or "0.0.1").split(".")
+    return f"{major}.{minor}.{int(patch) + 1}"
 
-        resp = requests.get(
-            f"{baseurl}/{room_id}/temperatures",
-            headers={'Content-Type': 'application/json',
-                     "Authorization": room_details_token},
-            params={'per_page': 500000, 'page': page},
-            timeout=(5,60)
+def latest_building_dataset(building_id:int, only_completed:bool=True):
+    """
+    Newest Building dataset of the building, None if there is none. Runs
+    always bump the version, and without a version ClearML returns the
+    highest one. Used by every reader of the Building datasets.
+    """
+    try:
+        return Dataset.get(
+            dataset_project=dataset_project,
+            dataset_name=f"Building-{building_id}",
+            only_completed=only_completed,
         )
+    except ValueError:
+        return None
+
+def load_fetch_state(path:str):
+    state_file = os.path.join(path, "fetch_state.json")
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        return json.load(f)
+
+def save_fetch_state(state:dict, path:str):
+    with open(os.path.join(path, "fetch_state.json"), "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+def high_water_mark(state, key:str, series_id:int):
+    if not state:
+        return None
+    return state.get(key, {}).get(str(series_id))
+
+def update_fetch_state(state, df:pd.DataFrame, key:str, id_col:str):
+    """Stores the newest `ts` of every series in `df` under state[key]."""
+    state = state if state is not None else {}
+    marks = state.setdefault(key, {})
+    if df.empty or 'ts' not in df.columns or id_col not in df.columns:
+        return state
+    latest = schema.parse_ts(df['ts']).groupby(df[id_col]).max()
+    for series_id, ts in latest.items():
+        if pd.isna(ts):
+            continue
+        previous = marks.get(str(series_id))
+        if previous is None or ts > pd.Timestamp(previous):
+            marks[str(series_id)] = ts.isoformat()
+    return state
+
+def building_fingerprint(building_id:int, state:dict):
+    """What a Building dataset was fetched from: its metadata rows and the newest ts of every series."""
+    return {
+        "metadata": load_index().building_digest(building_id),
+        "series": state,
+        "fetched_at": pd.Timestamp.now(tz="UTC").isoformat(),
+    }
+
+def get_fingerprint(dataset):
+    try:
+        return dataset.get_metadata("fingerprint")
+    except Exception as e:
+        print(f"Could not read the fingerprint of dataset {dataset.id}: {e}")
+        return None
+
+def drop_seen(df:pd.DataFrame, since):
+    # the API `from` filter works on whole days, drop what we already have
+    if since is None or df.empty or 'ts' not in df.columns:
+        return df
+    return df[schema.parse_ts(df['ts']) > pd.Timestamp(since)].reset_index(drop=True)
+
+def since_params(since):
+    if since is None:
+        return {}
+    return {'from': pd.Timestamp(since).strftime('%Y-%m-%d')}
+
+def fetch_page(url:str, token:str, page:int, per_page:int, since, endpoint:str, series_id:int, sizer):
+    """
+    Returns (records, payload, timed_out) of one page, records is None on
+    failure. A page after the first that keeps timing out is fetched as the
+    two pages of half the size covering the same records.
+    """
+    info = {}
+    half = per_page // 2
+    can_split = page > 1 and per_page % 2 == 0 and half >= sizer.PAGE_SIZES[0]
+    # fetch_first_page asks again with a smaller page
+    can_shrink = page == 1 and per_page > sizer.PAGE_SIZES[0]
+    payload = ebz_client.get_json(
+        url,
+        token,
+        params={'per_page': per_page, 'page': page, **since_params(since)},
+        endpoint=endpoint,
+        series_id=series_id,
+        info=info,
+        # a page that can get smaller is not retried at the size that timed out
+        timeout_retries=0 if can_split or can_shrink else None,
+    )
+    if payload is None:
+        if info["timed_out"] and can_split:
+            sizer.observe_timeout(per_page)
+            print(f"{endpoint} {series_id}: page {page} timed out, splitting it into two pages of {half}")
+            first, _, _ = fetch_page(url, token, 2 * page - 1, half, since, endpoint, series_id, sizer)
+            if first is None:
+                return None, None, True
+            second, _, _ = fetch_page(url, token, 2 * page, half, since, endpoint, series_id, sizer)
+            if second is None:
+                return None, None, True
+            return first + second, None, False
+        return None, None, info["timed_out"]
+
+    records = payload.get("data", []) if isinstance(payload, dict) else payload
+    if not info["cache_hit"]:
+        sizer.observe(len(records), info["elapsed"], info["bytes"])
+    return records, payload, False
+
+def fetch_first_page(url:str, token:str, since, endpoint:str, series_id:int, sizer):
+    """First page of a series, shrinking per_page while it times out. Returns (records, payload, per_page)."""
+    per_page = ebz_client.cached_page_size(endpoint, series_id) or sizer.size()
+    while True:
+        records, payload, timed_out = fetch_page(url, token, 1, per_page, since, endpoint, series_id, sizer)
+        if records is None and timed_out and per_page > sizer.PAGE_SIZES[0]:
+            sizer.observe_timeout(per_page)
+            per_page = sizer.size()
+            print(f"{endpoint} {series_id}: first page timed out, retrying with per_page={per_page}")
+            continue
+        return records, payload, per_page
+
+def fetch_room_temps(room_id: int, room_details_token: str, since=None, on_page=None, page_workers:int=1):
+    """
+    Once the first page tells num_pages, the remaining pages are fetched with
+    up to `page_workers` threads (the global in-flight cap of ebz_client still
+    applies). Pages are returned, or passed to `on_page`, in order. The fetch
+    stops at the first page that fails for good, so the records kept (and the
+    high-water mark taken from them) never skip a hole.
+    """
+    all_data = []
+    url = f"{baseurl}/{room_id}/temperatures"
+    print(f"Fetching room {room_id}, page 1")
+    data, resp_json, per_page = fetch_first_page(url, room_details_token, since, "room_temperatures", room_id, room_page_sizer)
 
-        if not (200 <= resp.status_code < 300):
-            print(f"Error fetching data for room {room_id}: {resp.status_code} - {resp.text}")
-            break
-
-        resp_json = resp.json()
-        data = resp_json.get("data", [])
-        num_pages = resp_json.get("num_pages", 1)
-        curr_page = resp_json.get("page", page)
+    if data is None:
+        print(f"Error fetching data for room {room_id}, page 1")
+        ebz_client.mark_truncated("room_temperatures", room_id, 1)
+        return all_data
 
+    if on_page is None:
         all_data.extend(data)
+    else:
+        on_page(data)
 
-        # Stop when server says “this is the last page”
-        if curr_page >= num_pages:
-            break
-
-        if not data:  # defensive break
-            break
+    # Stop when server says “this is the last page”
+    num_pages = resp_json.get("num_pages", 1)
+    if resp_json.get("page", 1) >= num_pages or not data:
+        return all_data
 
-        page += 1
+    def get(page):
+        print(f"Fetching room {room_id}, page {page}")
+        records, _, _ = fetch_page(url, room_details_token, page, per_page, since, "room_temperatures", room_id, room_page_sizer)
+        if records is None:
+            print(f"Error fetching data for room {room_id}, page {page}, dropping the pages after it")
+            ebz_client.mark_truncated("room_temperatures", room_id, page)
+        return records
+
+    def keep(records):
+        if on_page is None:
+            all_data.extend(records)
+        else:
+            on_page(records)
+
+    pages = range(2, num_pages + 1)
+    if page_workers > 1 and len(pages) > 1:
+        with ThreadPoolExecutor(max_workers=min(page_workers, len(pages))) as pool:
+            futures = [pool.submit(get, page) for page in pages]
+            for future in futures:
+                records = future.result()
+                if records is None:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                keep(records)
+    else:
+        for page in pages:
+            records = get(page)
+            if records is None:
+                break
+            keep(records)
 
     return all_data
 
  
 
-def fetch_building_rooms(building_id:int, room_details_token:str):
+def fetch_building_rooms(building_id:int, room_details_token:str, max_workers:int=1, state=None, page_workers:int=1):
     
     
-    building_rooms = room_meta_data[room_meta_data['building_id'] == building_id]
-    unique_rooms = building_rooms['room_id'].unique()
-    room_df_list = []
-    hca_df_list = []
-    units_df_list = []
-    for room in unique_rooms:
-        room_data = fetch_room_temps(room, room_details_token)
-        room_df = pd.json_normalize(room_data)
-        room_df_list.append(room_df)
-
-        hca_data, units_data = fetch_room_hcas(room, hca_details_token)
-        hca_df_list.append(hca_data)
-        units_df_list.append(units_data)
+    unique_rooms = load_index().rooms_of_building(building_id)
+    if max_workers > 1:
+        room_df_list, hca_df_list, units_df_list = fetch_rooms_concurrent(unique_rooms, room_details_token, max_workers, state, page_workers)
+    else:
+        room_df_list = []
+        hca_df_list = []
+        units_df_list = []
+        for room in unique_rooms:
+            room_df = fetch_room_frame(room, room_details_token, state, page_workers)
+            room_df_list.append(room_df)
+
+            hca_data, units_data = fetch_room_hcas(room, get_token("hca_details_token"), state)
+            hca_df_list.append(hca_data)
+            units_df_list.append(units_data)
     
     building__room_df = pd.concat(room_df_list, ignore_index=True)
     #building__room_df.to_csv(f"room_temp_ts.csv", index=False)
@@ -135,93 +315,392 @@ def fetch_building_rooms(building_id:int, room_details_token:str):
     # Task.current_task().upload_artifact(name="units_ts.csv", artifact_object=units__hca_df)
     return building__room_df, building__hca_df, units__hca_df
 
-def fetch_room_hcas(room_id:int, hca_details_token:str):
+def fetch_rooms_concurrent(room_ids, room_details_token:str, max_workers:int, state=None, page_workers:int=1):
+    """
+    Fetches all rooms and HCAs with at most `max_workers` requests in flight.
+    Every room and every HCA is its own job in a single pool, results are
+    collected in metadata order so the frames match the sequential path.
+    """
+    hca_details_token = get_token("hca_details_token")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        room_jobs = []
+        for room in room_ids:
+            room_future = pool.submit(fetch_room_frame, room, room_details_token, state, page_workers)
+            hca_futures = [pool.submit(fetch_hca, hca, hca_details_token, state) for hca in room_hca_ids(room)]
+            room_jobs.append((room, room_future, hca_futures))
+
+        room_df_list = []
+        hca_df_list = []
+        units_df_list = []
+        for room, room_future, hca_futures in room_jobs:
+            room_df_list.append(room_future.result())
+            hca_results = [future.result() for future in hca_futures]
+            hca_df_list.append(concat_or_empty([df for df, _ in hca_results]))
+            units_df_list.append(concat_or_empty([df_units for _, df_units in hca_results]))
+            print(f"Room ID: {room}, HCAs fetched: {len(hca_results)}")
+    return room_df_list, hca_df_list, units_df_list
+
+def room_hca_ids(room_id:int):
+    return load_index().hcas_of_room(room_id)
+
+def concat_or_empty(df_list):
+    try:
+        return pd.concat(df_list, ignore_index=True)
+    except ValueError:
+        return pd.DataFrame()
+
+def stream_building_rooms(building_id:int, room_details_token:str, output_dir:str, max_workers:int=1, state=None, append:bool=False, fmt:str="csv", page_workers:int=1):
+    """
+    Streaming variant of fetch_building_rooms: every API page is normalised
+    and appended to the tables in `output_dir` as soon as it arrives, so
+    memory is bounded by the page size instead of the building size. Row
+    order follows arrival order. Returns the updated fetch state.
+    """
+    unique_rooms = load_index().rooms_of_building(building_id)
+    hca_details_token = get_token("hca_details_token")
+    new_state = json.loads(json.dumps(state)) if state else {}
+    state_lock = threading.Lock()
+    writers = {
+        table: storage.page_writer(output_dir, table, building_id, fmt=fmt, append=append)
+        for table in storage.TABLES
+    }
+
+    def sink(table, key, id_col, since):
+        def on_page(data):
+            df = drop_seen(decode.records_to_frame(data), since)
+            writers[table].write(df)
+            with state_lock:
+                update_fetch_state(new_state, df, key, id_col)
+        return on_page
+
+    def room_job(room):
+        since = high_water_mark(state, "rooms", room)
+        fetch_room_temps(room, room_details_token, since=since, page_workers=page_workers,
+                         on_page=sink("room_temp_ts", "rooms", "room_id", since))
+
+    def hca_job(hca):
+        since = high_water_mark(state, "hcas", hca)
+        fetch_hca_temps(hca, hca_details_token, since=since,
+                        on_page=sink("allocator_ts", "hcas", "heat_cost_allocator_id", since))
+        since_units = high_water_mark(state, "units", hca)
+        fetch_hca_units(hca, hca_details_token, since=since_units,
+                        on_page=sink("units_ts", "units", "heat_cost_allocator_id", since_units))
+
+    jobs = []
+    for room in unique_rooms:
+        jobs.append((room_job, room))
+        jobs.extend((hca_job, hca) for hca in room_hca_ids(room))
+
+    try:
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for future in [pool.submit(job, arg) for job, arg in jobs]:
+                    future.result()
+        else:
+            for job, arg in jobs:
+                job(arg)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    print(f"Streamed building {building_id}: " + ", ".join(f"{name} {writer.rows} rows" for name, writer in writers.items()))
+    return new_state
+
+def fetch_room_frame(room_id:int, room_details_token:str, state=None, page_workers:int=1):
+    since = high_water_mark(state, "rooms", room_id)
+    data = fetch_room_temps(room_id, room_details_token, since=since, page_workers=page_workers)
+    return drop_seen(decode.records_to_frame(data), since)
+
+def fetch_hca(hca_id:int, hca_details_token:str, state=None):
+    since = high_water_mark(state, "hcas", hca_id)
+    data = fetch_hca_temps(hca_id, hca_details_token, since=since)
+    df = drop_seen(decode.records_to_frame(data), since)
+
+    since_units = high_water_mark(state, "units", hca_id)
+    data_units = fetch_hca_units(hca_id, hca_details_token, since=since_units)
+    df_units = drop_seen(decode.records_to_frame(data_units), since_units)
+    return df, df_units
+
+def fetch_room_hcas(room_id:int, hca_details_token:str, state=None):
     
     
-    room_hcas = hca_metadata[(hca_metadata['room_id'] == room_id)]
-    unique_hcas = room_hcas['heat_cost_allocator_id'].unique()
+    unique_hcas = room_hca_ids(room_id)
     df_list = []
     df_list_units = []
     for hca in unique_hcas:
-        data = fetch_hca_temps(hca, hca_details_token)
-        df = pd.json_normalize(data)
+        df, df_units = fetch_hca(hca, hca_details_token, state)
         df_list.append(df)
-
-        data_units = fetch_hca_units(hca,hca_details_token)
-        df_units = pd.json_normalize(data_units)
         df_list_units.append(df_units)
         print(f"Room ID: {room_id}, HCA ID: {hca}, len df_list: {len(df_list)}")
-    try:
-        room_hca_df = pd.concat(df_list, ignore_index=True)
-    except ValueError:
-        room_hca_df = pd.DataFrame()
-    try:
-        units_df = pd.concat(df_list_units, ignore_index=True)
-    except ValueError:
-        units_df = pd.DataFrame()
+    room_hca_df = concat_or_empty(df_list)
+    units_df = concat_or_empty(df_list_units)
     return room_hca_df, units_df
 
-def fetch_hca_temps(hca_id:int, hca_details_token:str):
+def fetch_hca_temps(hca_id:int, hca_details_token:str, since=None, on_page=None):
     
     all_data = []
+    url = f"{baseurl}/{hca_id}/temperatures"
     page = 1
+    print(f"Fetching HCA {hca_id}, page {page}")
+    resp_data, _, per_page = fetch_first_page(url, hca_details_token, since, "hca_temperatures", hca_id, hca_page_sizer)
+    # records per page the server actually applied, it may cap per_page
+    page_size = per_page
+    # page 2 is asked for only to learn whether a short first page was capped
+    probing = False
     while True:
-        print(f"Fetching HCA {hca_id}, page {page}")
-        resp = requests.get(
-            f"{baseurl}/{hca_id}/temperatures",
-            headers={'Content-Type': 'application/json',"Authorization": hca_details_token},
-            params={'per_page': 500000, "page": page},
-            timeout=(5,60)
-        )
-        page += 1
-        if 200 <= resp.status_code < 300:
-            
-            resp_data = resp.json()
-            
+        if resp_data is None:
+            print(f"Error fetching data for HCA {hca_id}, page {page}")
+            ebz_client.mark_truncated("hca_temperatures", hca_id, page)
+            break
+        if on_page is None:
             all_data.extend(resp_data)
-            if resp_data == []:
-                break
         else:
-            print(f"Error fetching data for HCA {hca_id}: {resp.status_code} - {resp.text}")
+            on_page(resp_data)
+        if probing:
+            # more records after the short first page: the server capped it
+            hca_page_sizer.observe_page_length(page_size, capped=bool(resp_data))
+            probing = False
+        # the endpoint sends no page count: an empty page or one shorter than
+        # the applied page size is the last one
+        if not resp_data:
             break
+        if len(resp_data) > page_size:
+            print(f"HCA {hca_id}: page {page} has {len(resp_data)} records after pages of {page_size}, stopping")
+            ebz_client.mark_truncated("hca_temperatures", hca_id, page, reason="inconsistent page sizes")
+            break
+        if len(resp_data) < page_size:
+            if page > 1:
+                break
+            # a short first page is the whole series or the server's cap of per_page
+            is_last = hca_page_sizer.is_last_page(per_page, len(resp_data))
+            if is_last:
+                break
+            page_size = len(resp_data)
+            probing = is_last is None
+        elif page == 1:
+            hca_page_sizer.observe_page_length(len(resp_data), capped=False)
+        page += 1
+        print(f"Fetching HCA {hca_id}, page {page}")
+        resp_data, _, _ = fetch_page(url, hca_details_token, page, per_page, since, "hca_temperatures", hca_id, hca_page_sizer)
     return all_data
 
-def fetch_hca_units(hca_id:int, hca_details_token:str):
-    resp = requests.get(
-        f"{baseurl}/{hca_id}/units",
-        headers={'Content-Type': 'application/json',"Authorization": hca_details_token},
-        timeout=(5,60)
-    )
-    if 200 <= resp.status_code < 300:
-        return resp.json()
-    else:
-        print(f"Error fetch in unit data for HCA {hca_id}: {resp.status_code} - {resp.text}")
+def fetch_hca_units(hca_id:int, hca_details_token:str, since=None, on_page=None):
+    resp_data = ebz_client.get_json(f"{baseurl}/{hca_id}/units", hca_details_token, params=since_params(since) or None,
+                                    endpoint="hca_units", series_id=hca_id)
+    if resp_data is None:
+        print(f"Error fetch in unit data for HCA {hca_id}")
+        ebz_client.mark_truncated("hca_units", hca_id)
         return []
+    if on_page is not None:
+        on_page(resp_data)
+        return []
+    return resp_data
+
+
+def series_changed(url:str, token:str, since, endpoint:str, series_id:int, paged:bool=True):
+    """
+    One small uncached request telling whether a series has records newer
+    than `since`. Failed probes count as changed so the fetch runs.
+    """
+    params = since_params(since)
+    if paged:
+        params.update({'per_page': PROBE_PAGE_SIZE, 'page': 1})
+    payload = ebz_client.get_json(url, token, params=params or None, endpoint=f"{endpoint}_probe",
+                                  series_id=series_id, use_cache=False)
+    if payload is None:
+        return True
+    records = payload.get("data", []) if isinstance(payload, dict) else payload
+    if isinstance(payload, dict) and payload.get("num_pages", 1) > 1:
+        return True
+    if paged and len(records) >= PROBE_PAGE_SIZE:
+        return True
+    return not drop_seen(decode.records_to_frame(records), since).empty
+
+def building_changed(building_id:int, fingerprint, max_workers:int=1):
+    """
+    Pre-check of --skip_unchanged against the fingerprint of the last
+    Building dataset: True if the metadata of the building changed or any
+    room / HCA has new records. HCAs removed before the last fetch are not
+    probed.
+    """
+    index = load_index()
+    if not fingerprint or fingerprint.get("metadata") != index.building_digest(building_id):
+        return True
+    state = fingerprint.get("series") or {}
+    retired = index.retired_hcas(fingerprint["fetched_at"])
+    room_token = get_token("room_details_token")
+    hca_token = get_token("hca_details_token")
+
+    probes = []
+    for room in index.rooms_of_building(building_id):
+        probes.append((f"{baseurl}/{room}/temperatures", room_token, high_water_mark(state, "rooms", room), "room_temperatures", room, True))
+    for hca in index.hcas_of_building(building_id):
+        if hca in retired:
+            continue
+        probes.append((f"{baseurl}/{hca}/temperatures", hca_token, high_water_mark(state, "hcas", hca), "hca_temperatures", hca, True))
+        probes.append((f"{baseurl}/{hca}/units", hca_token, high_water_mark(state, "units", hca), "hca_units", hca, False))
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+        futures = [pool.submit(series_changed, *probe) for probe in probes]
+        for future in as_completed(futures):
+            if future.result():
+                # first change decides, drop the probes not started yet
+                for pending in futures:
+                    pending.cancel()
+                return True
+    return False
+
+
+def copy_previous(previous_path:str, output_dir:str, table:str, building_id:int, fmt:str="csv"):
+    """Seeds `output_dir` with the previous version of `table` so new records can be appended."""
+    previous_dir = os.path.join(previous_path, table)
+    previous_file = os.path.join(previous_path, f"{table}.csv")
+    if fmt == "parquet" and os.path.isdir(previous_dir):
+        shutil.copytree(previous_dir, os.path.join(output_dir, table), dirs_exist_ok=True)
+    elif fmt == "csv" and os.path.exists(previous_file):
+        with open(previous_file, "rb") as f:
+            is_gzip = f.read(2) == b"\x1f\x8b"
+        opener = gzip.open if is_gzip else open
+        with opener(previous_file, "rb") as src, open(os.path.join(output_dir, f"{table}.csv"), "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    elif os.path.isdir(previous_dir) or os.path.exists(previous_file):
+        # previous version was written in the other format
+        storage.write_table(storage.read_table(previous_path, table), output_dir, table, building_id, fmt=fmt)
+
+
+def parse_building_ids(value:str) -> list:
+    """'4,10,18-21' -> [4, 10, 18, 19, 20, 21], each building once in the order given"""
+    building_ids = []
+    for part in str(value).replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            building_ids.extend(range(int(start), int(end) + 1))
+        else:
+            building_ids.append(int(part))
+    return list(dict.fromkeys(building_ids))
 
+def run_building(building_id:int, args):
+    absolute_path = f"/tmp/building_{building_id}"
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--building_id", type=int, default=57, help="Building ID to fetch")
-    
-    args = parser.parse_args()
-    
-
-    absolute_path = f"/tmp/building_{args.building_id}"
-
-    output_dir = os.path.join(absolute_path, str(args.building_id))
+    output_dir = os.path.join(absolute_path, str(building_id))
     os.makedirs(output_dir, exist_ok=True)
-
+    ebz_client.metrics.reset()
+    ebz_client.reset_truncated()
+
+    previous_dataset = None
+    previous_path = None
+    state = None
+    if args.skip_unchanged:
+        last_dataset = latest_building_dataset(building_id)
+        if last_dataset is not None and not building_changed(building_id, get_fingerprint(last_dataset), args.max_workers):
+            print(f"Building {building_id} unchanged since dataset version {last_dataset.version}, skipping")
+            return False
+    if args.incremental:
+        previous_dataset = latest_building_dataset(building_id)
+        if previous_dataset is not None:
+            previous_path = os.path.join(previous_dataset.get_local_copy(), f"building-{building_id}")
+            state = load_fetch_state(previous_path)
+        if state is None:
+            print(f"No fetch state for building {building_id}, falling back to a full fetch")
+            previous_dataset = None
+        else:
+            print(f"Incremental fetch on top of dataset version {previous_dataset.version}")
 
     # print(f"base_dir: {base_dir}")
     print(f"output_dir: {output_dir}")
-    # print(f"Fetching building: {args.building_id}")
-    building__room_df, building__hca_df, units__hca_df = fetch_building_rooms(args.building_id, room_details_token)
-    
-    building__room_df.to_csv(os.path.join(output_dir, "room_temp_ts.csv"), index=False)
-    building__hca_df.to_csv(os.path.join(output_dir, "allocator_ts.csv"), index=False)
-    units__hca_df.to_csv(os.path.join(output_dir, "units_ts.csv"), index=False)
+    # print(f"Fetching building: {building_id}")
+    # the report of truncated series is only written when there are some, drop one left by an earlier run
+    truncated_file = os.path.join(output_dir, "truncated_series.json")
+    if os.path.exists(truncated_file):
+        os.remove(truncated_file)
+    for table in storage.TABLES:
+        storage.clear_table(output_dir, table)
+        if previous_dataset is not None:
+            copy_previous(previous_path, output_dir, table, building_id, fmt=args.format)
+    append = previous_dataset is not None
+
+    if args.stream:
+        state = stream_building_rooms(building_id, get_token("room_details_token"), output_dir, max_workers=args.max_workers,
+                                      state=state, append=append, fmt=args.format, page_workers=args.page_workers)
+    else:
+        building__room_df, building__hca_df, units__hca_df = fetch_building_rooms(building_id, get_token("room_details_token"), max_workers=args.max_workers, state=state, page_workers=args.page_workers)
+
+        state = update_fetch_state(state, building__room_df, "rooms", "room_id")
+        state = update_fetch_state(state, building__hca_df, "hcas", "heat_cost_allocator_id")
+        state = update_fetch_state(state, units__hca_df, "units", "heat_cost_allocator_id")
+        if append:
+            print(f"New records: rooms {len(building__room_df)}, hcas {len(building__hca_df)}, units {len(units__hca_df)}")
+
+        storage.write_table(building__room_df, output_dir, "room_temp_ts", building_id, fmt=args.format, append=append)
+        storage.write_table(building__hca_df, output_dir, "allocator_ts", building_id, fmt=args.format, append=append)
+        storage.write_table(units__hca_df, output_dir, "units_ts", building_id, fmt=args.format, append=append)
+    save_fetch_state(state, output_dir)
+
+    summary = ebz_client.metrics.summary()
+    n_rooms = len(load_index().rooms_of_building(building_id))
+    summary.update({
+        "building_id": building_id,
+        "rooms": n_rooms,
+        "hcas": len(load_index().hcas_of_building(building_id)),
+        "rooms_per_s": n_rooms / summary["elapsed_s"],
+        "max_workers": args.max_workers,
+    })
+    print(f"Fetched building {building_id}: {summary['records']} records, {summary['bytes'] / 1e6:.1f} MB "
+          f"in {summary['elapsed_s']:.1f}s ({summary['records_per_s']:.0f} records/s)")
+    with open(os.path.join(output_dir, "fetch_metrics.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    report_to_clearml(summary, title=f"fetch building {building_id}")
+
+    truncated = ebz_client.truncated_series()
+    if truncated:
+        print(f"WARNING: {len(truncated)} series ended truncated:")
+        pprint.pprint(truncated)
+        with open(truncated_file, "w") as f:
+            json.dump(truncated, f, indent=2)
+
+    #output_dir = f"./{building_id}/"
+    create_building_dataset(building_id, output_dir, previous_dataset=previous_dataset,
+                            fingerprint=building_fingerprint(building_id, state))
+    return True
+
+def main(args):
+    building_ids = parse_building_ids(args.building_ids) if args.building_ids else [args.building_id]
+    # session, page cache, metadata index and metadata dataset are shared by the whole batch
+    ebz_client.configure_session(pool_size=max(args.max_workers, 1))
+    ebz_client.configure_cache(args.cache_dir, max_age=args.cache_max_age * 3600)
+
+    failed = {}
+    skipped = []
+    for position, building_id in enumerate(building_ids, 1):
+        print(f"=== Building {building_id} ({position}/{len(building_ids)}) ===")
+        try:
+            if not run_building(building_id, args):
+                skipped.append(building_id)
+        except Exception as e:
+            traceback.print_exc()
+            failed[building_id] = f"{type(e).__name__}: {e}"
+
+    print(f"Finished {len(building_ids) - len(failed)}/{len(building_ids)} buildings ({len(skipped)} unchanged)")
+    if failed:
+        print("Failed buildings:")
+        pprint.pprint(failed)
+    return failed
 
-    #output_dir = f"./{args.building_id}/"
-    create_building_dataset(args.building_id, output_dir)
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--building_id", type=int, default=57, help="Building ID to fetch")
+    parser.add_argument("--building_ids", type=str, default=None, help="Comma separated building IDs and ranges (e.g. '4,10,18-21') fetched in this one process; overrides --building_id")
+    parser.add_argument("--max_workers", type=int, default=8, help="Maximum number of concurrent API requests (1 = sequential)")
+    parser.add_argument("--page_workers", type=int, default=4, help="Pages of one room series fetched in parallel once the page count is known")
+    parser.add_argument("--incremental", action="store_true", help="Only fetch records newer than the last Building dataset and append them")
+    parser.add_argument("--stream", action="store_true", help="Write every API page straight to disk instead of building the frames in memory")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Output format of the building dataset")
+    parser.add_argument("--skip_unchanged", action="store_true", help="Probe the API first and keep the last Building dataset if no series has new records")
+    parser.add_argument("--cache_dir", type=str, default=os.environ.get("EBZ_CACHE_DIR"), help="Directory of the on-disk API page cache (disabled if not set)")
+    parser.add_argument("--cache_max_age", type=float, default=24, help="Hours a cached page is reused without revalidation")
+    
+    args = parser.parse_args()
+    failed = main(args)
+    sys.exit(1 if failed else 0)
@@ -1,6 +1,7 @@
 from clearml.automation.controller import PipelineController
 from clearml import Task
 import pandas as pd
+import argparse
 
 
 PIPELINE_PROJECT_NAME = "ForeSightNEXT/BaltBest"
@@ -10,9 +11,20 @@ PIPELINE_TASK_NAME = "Building Data Fetch Pipeline"
 BASE_TASK_PROJECT = "ForeSightNEXT/BaltBest"
 BASE_TASK_NAME = "Fetch Building Data Remotely" 
 
-def main(building_ids):
+RESAMPLE_TASK_NAME = "Resample Test Remote Execution"
+QA_TASK_NAME = "Data QA"
+
+def main(building_ids, max_parallel:int=4, with_downstream:bool=True, batch_size:int=1, skip_unchanged:bool=False, incremental:bool=False):
     """
     Initializes and executes the ClearML Pipeline.
+
+    Building fetches are independent and fan out over `max_parallel` lanes:
+    step i waits only for step i - max_parallel, so at most `max_parallel`
+    fetches run at once. Resample joins all fetch steps, QA follows resample.
+    With `batch_size` > 1 every step fetches that many buildings in one task.
+    With `skip_unchanged` fetch steps keep the Building dataset of buildings
+    without new records, and resample reuses its output for them. With
+    `incremental` resample only recomputes the hours after its last output.
     """
 
     pipe = PipelineController(
@@ -35,20 +47,35 @@ def main(building_ids):
 
 
     
-    previous_step = None
-
-    for building_id in building_ids:
-
-        task_name = f"{BASE_TASK_NAME}-building {building_id}"
-        step_name = f"Building_{building_id}_Fetch"
+    lanes = [None] * max(max_parallel, 1)
+    fetch_steps = []
+
+    batch_size = max(batch_size, 1)
+    batches = [building_ids[i:i + batch_size] for i in range(0, len(building_ids), batch_size)]
+
+    for i, batch in enumerate(batches):
+
+        batch_arg = ",".join(str(building_id) for building_id in batch)
+        if len(batch) == 1:
+            task_name = f"{BASE_TASK_NAME}-building {batch[0]}"
+            step_name = f"Building_{batch[0]}_Fetch"
+        else:
+            task_name = f"{BASE_TASK_NAME}-buildings {batch_arg}"
+            step_name = f"Buildings_{'_'.join(str(building_id) for building_id in batch)}_Fetch"
+        previous_step = lanes[i % len(lanes)]
+
+        parameter_override = {
+            'Task/name': task_name,
+            'Args/building_id': batch[0],
+            'Args/building_ids': batch_arg,
+        }
+        if skip_unchanged:
+            parameter_override['Args/skip_unchanged'] = True
 
         pipe.add_step(
             name=step_name,
             base_task_id=base_task_id,
-            parameter_override={
-                'Task/name': task_name,
-                'Args/building_id': building_id
-            },
+            parameter_override=parameter_override,
             execution_queue="default",
             parents=[previous_step] if previous_step else None,
             continue_behaviour={
@@ -56,18 +83,48 @@ def main(building_ids):
     }
         )
 
-        previous_step = step_name
-        
+        lanes[i % len(lanes)] = step_name
+        fetch_steps.append(step_name)
+
+    if with_downstream:
+        resample_override = {}
+        if skip_unchanged:
+            resample_override['General/reuse_unchanged'] = True
+        if incremental:
+            resample_override['General/incremental'] = True
+        pipe.add_step(
+            name="Resample",
+            base_task_project=BASE_TASK_PROJECT,
+            base_task_name=RESAMPLE_TASK_NAME,
+            parameter_override=resample_override or None,
+            execution_queue="default",
+            parents=fetch_steps,
+        )
+        pipe.add_step(
+            name="Data_QA",
+            base_task_project=BASE_TASK_PROJECT,
+            base_task_name=QA_TASK_NAME,
+            execution_queue="default",
+            parents=["Resample"],
+        )
 
 
-    print(f"Executing pipeline on buildings: {building_ids}")
+    print(f"Executing pipeline on buildings: {building_ids} ({len(lanes)} in parallel)")
     #pipe.start_locally(queue="default") 
     pipe.start(queue="default")
     print("Pipeline execution initiated.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max_parallel", type=int, default=4, help="Maximum number of building fetch steps running at once")
+    parser.add_argument("--no_downstream", action="store_true", help="Only fetch, do not add the resample and QA steps")
+    parser.add_argument("--batch_size", type=int, default=1, help="Buildings fetched by one worker task")
+    parser.add_argument("--skip_unchanged", action="store_true", help="Do not re-fetch or re-resample buildings without new records")
+    parser.add_argument("--incremental", action="store_true", help="Resample only the hours after the last resampled output")
+    args = parser.parse_args()
+
     building_ids = pd.read_csv("metadata/rooms_metadata.csv")['building_id'].unique().tolist()
     building_ids = [i for i in building_ids if i not in [2,7,13,14,16,17,20,28,38,58,66,73,74]]
-    main(building_ids)
+    main(building_ids, max_parallel=args.max_parallel, with_downstream=not args.no_downstream, batch_size=args.batch_size, skip_unchanged=args.skip_unchanged, incremental=args.incremental)
     # [4, 10, 18, 21, 23, 24, 26, 39, 45, 46, 47, 50, 52, 53, 57]
\ No newline at end of file
@@ -2,46 +2,68 @@ import pandas as pd
 import numpy as np
 from clearml import Dataset, Task
 
+import dataset_cache
+import schema
+import storage
+
 def fix_reset(hca_units: pd.DataFrame) -> pd.DataFrame:
-    hca_units = hca_units.sort_values(
-        ['heat_cost_allocator_id', 'ts']
-    ).copy()
-
-    def _fix(group: pd.DataFrame) -> pd.DataFrame:
-        prev_units = group['units'].shift()
-        # detect reset when units drop to 0 after being positive
-        is_reset = (group['units'] == 0) & (prev_units > 0)
-
-        offset = (
-            prev_units
-            .where(is_reset, 0)
-            .cumsum()
-        )
-
-        group['units'] = group['units'] + offset
-        return group
-
-    return (
-        hca_units
-        .groupby('heat_cost_allocator_id', group_keys=False)
-        .apply(_fix)
+    """
+    Units with the counter resets of every HCA undone: when the units drop
+    to 0 after a positive reading, that reading is added to all later ones.
+    All HCAs in one pass over the rows sorted by HCA and ts.
+    """
+    hca_units = hca_units[hca_units['heat_cost_allocator_id'].notna()].sort_values(
+        ['heat_cost_allocator_id', 'ts'], kind='stable'
     )
+    hca = hca_units['heat_cost_allocator_id'].to_numpy(dtype=np.float64)
+    first = np.ones(len(hca), dtype=bool)
+    first[1:] = hca[1:] != hca[:-1]
+    group = np.cumsum(first)
 
+    units = hca_units['units']
+    # the first reading of an HCA has no previous one
+    prev_units = units.shift().mask(first)
+    # detect reset when units drop to 0 after being positive
+    is_reset = (units == 0) & (prev_units > 0)
+    resets = np.flatnonzero(is_reset.to_numpy())
+    offset = prev_units.to_numpy()[resets]
+    # running sum of the dropped readings per HCA, added up reset by reset in
+    # the units dtype like a cumsum per HCA: the n-th resets of all HCAs at once
+    reset_group = group[resets]
+    nth = np.arange(len(resets))
+    nth -= np.maximum.accumulate(np.where(np.r_[True, reset_group[1:] != reset_group[:-1]], nth, 0))
+    for n in range(1, nth.max() + 1 if len(nth) else 0):
+        later = np.flatnonzero(nth == n)
+        offset[later] += offset[later - 1]
 
+    # every row gets the offset of the last reset of its HCA up to it
+    row_offset = np.zeros(len(units), dtype=offset.dtype)
+    last = np.full(len(units), -1)
+    last[resets] = np.arange(len(resets))
+    last = np.maximum.accumulate(last)
+    has_reset = last >= 0
+    has_reset[has_reset] = reset_group[last[has_reset]] == group[has_reset]
+    row_offset[has_reset] = offset[last[has_reset]]
+    return hca_units.assign(units=units + row_offset)
 
-def align_hca(resampled: pd.DataFrame, hca_units:pd.DataFrame) -> pd.DataFrame:
-    
-    
+
+def align_hca(resampled: pd.DataFrame, hca_units:pd.DataFrame, reset_fixed:bool=False) -> pd.DataFrame:
+    """
+    Daily upsampled units of a room next to the daily deltas of its HCA
+    units. `reset_fixed`: fix_reset already ran on the units (without
+    missing units), e.g. once on the whole table.
+    """
     hca_units = hca_units[hca_units['units'].notna()]
-    resampled.ts = pd.to_datetime(resampled.ts)
-    hca_units.ts = pd.to_datetime(hca_units.ts)
+    resampled.ts = schema.parse_ts(resampled.ts)
+    hca_units.ts = schema.parse_ts(hca_units.ts)
 
     if ((hca_units['units'] == 0).all() or hca_units.empty):
         return pd.DataFrame()
     
     hca_units = hca_units.sort_values(['room_id','ts'])
 
-    hca_units = fix_reset(hca_units)
+    if not reset_fixed:
+        hca_units = fix_reset(hca_units)
     hca_units = hca_units.resample('D', on='ts').agg({'units':'sum'}).reset_index()
     res = resampled.copy()
     res = res.resample('D', on='ts').agg({'hca_units':'sum'}).reset_index()
@@ -51,8 +73,8 @@ def align_hca(resampled: pd.DataFrame, hca_units:pd.DataFrame) -> pd.DataFrame:
     merged = pd.merge(res, hca_units, on=['ts'], how='inner')
     return merged
 
-def calculate_mape_rmse(resampled:pd.DataFrame, hca_units:pd.DataFrame) -> tuple:
-    merged = align_hca(resampled, hca_units)
+def calculate_mape_rmse(resampled:pd.DataFrame, hca_units:pd.DataFrame, reset_fixed:bool=False) -> tuple:
+    merged = align_hca(resampled, hca_units, reset_fixed=reset_fixed)
     if merged.empty:
         return np.nan, np.nan
     merged = merged[merged.hca_units != 0]
@@ -103,7 +125,7 @@ def consecutive_vals(col:pd.Series):
         out[f'total_len_consec_gte_{k}'] = sum_out[k]
     return out
 
-def df_qa(resampled: pd.DataFrame, hca_units:pd.DataFrame) -> pd.DataFrame:
+def df_qa_pandas(resampled: pd.DataFrame, hca_units:pd.DataFrame) -> pd.DataFrame:
     cols = [c for c in resampled.columns if c not in ['room_id', 'ts', 'building_id']]
     resampled = resampled.sort_values(['room_id', 'ts'])
     all_rooms = []
@@ -139,26 +161,127 @@ def df_qa(resampled: pd.DataFrame, hca_units:pd.DataFrame) -> pd.DataFrame:
     return result
 
 
+QA_ENGINES = ["numpy", "pandas"]
+
+GAP_BINS = 12
+CONSEC_BINS = {'1d': 24, '2d': 2*24, '4d': 4*24, '7d': 7*24, '14d': 14*24}
+
+def run_lengths(codes:np.ndarray, flags:np.ndarray):
+    """
+    Runs of equal `flags` within equal `codes` (rows sorted by code): the
+    code, flag and length of every run.
+    """
+    new_run = np.ones(len(codes), dtype=bool)
+    new_run[1:] = (codes[1:] != codes[:-1]) | (flags[1:] != flags[:-1])
+    starts = np.flatnonzero(new_run)
+    lengths = np.diff(np.append(starts, len(codes)))
+    return codes[starts], flags[starts], lengths
+
+def column_qa(codes:np.ndarray, n_rooms:int, values:np.ndarray) -> dict:
+    """count_na, consecutive_vals and the row counts of one column for all rooms at once, as arrays per room."""
+    is_na = np.isnan(values)
+    run_room, run_na, lengths = run_lengths(codes, is_na)
+    out = {}
+
+    # gaps of exactly 1..12 hours, longer ones together
+    gap_room, gap_len = run_room[run_na], lengths[run_na]
+    gap_bin = np.minimum(gap_len, GAP_BINS + 1) - 1
+    gaps = np.bincount(gap_room * (GAP_BINS + 1) + gap_bin, minlength=n_rooms * (GAP_BINS + 1)).reshape(n_rooms, GAP_BINS + 1)
+    for i in range(GAP_BINS):
+        out[f'n_gaps_gte_{i + 1}h'] = gaps[:, i]
+    out[f'n_gaps_gte_>{GAP_BINS}h'] = gaps[:, GAP_BINS]
+
+    # every threshold a run reaches counts it, like consecutive_vals
+    val_room, val_len = run_room[~run_na], lengths[~run_na]
+    counts, sums = {}, {}
+    for k, threshold in CONSEC_BINS.items():
+        long_run = val_len >= threshold
+        counts[k] = np.bincount(val_room[long_run], minlength=n_rooms)
+        sums[k] = np.bincount(val_room[long_run], weights=val_len[long_run], minlength=n_rooms).astype(np.int64)
+    for k in CONSEC_BINS:
+        out[f'n_consec_gte_{k}'] = counts[k]
+    for k in CONSEC_BINS:
+        out[f'total_len_consec_gte_{k}'] = sums[k]
+
+    n_rows = np.bincount(codes, minlength=n_rooms)
+    non_null = np.bincount(codes, weights=~is_na, minlength=n_rooms).astype(np.int64)
+    # NaN != 0, so missing values count as non-zero like in df_qa_pandas
+    non_zero = np.bincount(codes, weights=values != 0, minlength=n_rooms).astype(np.int64)
+    out['n_rows'] = n_rows
+    out['total_non_null'] = non_null
+    out['n_nan_rows'] = n_rows - non_null
+    out['non_nan_ratio'] = non_null / n_rows
+    out['non_zero_rows'] = non_zero
+    out['non_zero_ratio'] = non_zero / n_rows
+    return out
+
+def df_qa(resampled: pd.DataFrame, hca_units:pd.DataFrame, engine:str="numpy") -> pd.DataFrame:
+    """
+    Per (room_id, variable) gap histogram, consecutive-value runs, null and
+    zero ratios and the upsampling error against the units. The numpy
+    engine computes the run-length encodings of all rooms and variables
+    with array operations and gives the report of df_qa_pandas.
+    """
+    if engine not in QA_ENGINES:
+        raise ValueError(f"Unknown QA engine {engine!r}, expected one of {QA_ENGINES}")
+    if engine == "pandas":
+        return df_qa_pandas(resampled, hca_units)
+
+    cols = [c for c in resampled.columns if c not in ['room_id', 'ts', 'building_id']]
+    resampled = resampled[resampled['room_id'].notna()].sort_values(['room_id', 'ts'], kind='stable')
+    room_ids, codes = np.unique(resampled['room_id'].to_numpy(), return_inverse=True)
+    n_rooms = len(room_ids)
+
+    # resets fixed and units split by room once instead of per room
+    hca_units = fix_reset(hca_units[hca_units['units'].notna()])
+    units_by_room = dict(tuple(hca_units.groupby('room_id')))
+    no_units = hca_units.iloc[:0]
+    errors = np.full((n_rooms, 2), np.nan)
+    for i, (room_id, group) in enumerate(resampled[['room_id', 'hca_units', 'ts']].groupby('room_id', sort=True)):
+        errors[i] = calculate_mape_rmse(group[['hca_units','ts']], units_by_room.get(room_id, no_units), reset_fixed=True)
+
+    per_col = [column_qa(codes, n_rooms, resampled[col].to_numpy(dtype=np.float64)) for col in cols]
+    # rows by room, then variable, like the loops of df_qa_pandas
+    result = {key: np.stack([qa[key] for qa in per_col], axis=1).ravel() for key in per_col[0]} if cols else {}
+    result['room_id'] = np.repeat(room_ids, len(cols))
+    result['variable'] = np.tile(np.asarray(cols, dtype=object), n_rooms)
+    result['upsampling_mape'] = np.repeat(errors[:, 0], len(cols))
+    result['upsampling_rmse'] = np.repeat(errors[:, 1], len(cols))
+    return pd.DataFrame(result).set_index(['room_id', 'variable'])
+
+
 def main():
     task = Task.init(project_name='ForeSightNEXT/BaltBest', task_name='Data QA')
+    # units_source: 'artifact' (all_units_data of the units task) or 'dataset' (partitioned UnitsData)
+    params = task.connect({'units_source': 'artifact'})
     task.set_packages(packages='requirements.txt')
     task.execute_remotely(queue_name="default")
 
 
-    dataset = Dataset.get(dataset_name='ResampledData', dataset_project='ForeSightNEXT/BaltBest/resampled', dataset_version="0.0.1")
-    local_path = dataset.get_local_copy()
-    resampled = pd.read_csv(f"{local_path}/resampled_data.csv",index_col = 0)
-    resampled['ts'] = pd.to_datetime(resampled['ts'])
+    unit_task = Task.get_task(task_name='Fetch Units Remote Execution', project_name='ForeSightNEXT/BaltBest',task_id='0d438a74ff5c4cbf99ecc8725437f1da')
+    # both downloads run at once, the dataset copy is reused by later runs
+    sources = {
+        'resampled': lambda: dataset_cache.cached_copy(Dataset.get(dataset_name='ResampledData', dataset_project='ForeSightNEXT/BaltBest/resampled', dataset_version="0.0.1")),
+        'units': lambda: unit_task.artifacts['all_units_data'].get_local_copy(),
+    }
+    if params['units_source'] == 'dataset':
+        sources['units'] = lambda: dataset_cache.cached_copy(Dataset.get(dataset_name='UnitsData', dataset_project='ForeSightNEXT/BaltBest/resampled', dataset_version="0.0.1"))
+    paths = dict(dataset_cache.prefetch(sources, lambda key: sources[key]()))
+
+    # one table over all building partitions (or the older single CSV)
+    resampled = storage.load_resampled(paths['resampled'])
 
     print(f"resampled.head():\n{resampled.head()}")
 
-    unit_task = Task.get_task(task_name='Fetch Units Remote Execution', project_name='ForeSightNEXT/BaltBest',task_id='0d438a74ff5c4cbf99ecc8725437f1da')
-    data_path = unit_task.artifacts['all_units_data'].get_local_copy()
-    try:
-        hca_units = pd.read_csv(data_path,index_col = 0)
-    except Exception as e:
-        hca_units = pd.read_csv(data_path, compression='gzip', index_col = 0)
-    hca_units['ts'] = pd.to_datetime(hca_units['ts'])
+    data_path = paths['units']
+    if params['units_source'] == 'dataset':
+        hca_units = storage.load_units(data_path)
+    else:
+        try:
+            hca_units = pd.read_csv(data_path,index_col = 0)
+        except Exception as e:
+            hca_units = pd.read_csv(data_path, compression='gzip', index_col = 0)
+    hca_units = schema.apply(hca_units)
     hca_units.groupby('room_id').resample('D', on='ts').agg({'units':'sum'}).reset_index()
 
     print(f"hca_units.head():\n{hca_units.head()}")
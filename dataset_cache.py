@@ -0,0 +1,111 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metadata_index import CACHE_DIR
+
+# Local copies of ClearML datasets under CACHE_DIR/datasets/<dataset id>. A
+# dataset id names immutable content, so a copy is downloaded once and then
+# shared by every worker process and every later run on the machine. The
+# marker of a copy holds the dataset name and its mtime the last use; every new
+# version of a dataset evicts the least recently used copies of older versions.
+
+DATASET_CACHE = os.path.join(CACHE_DIR, "datasets")
+COMPLETE_MARKER = ".complete"
+KEEP_COPIES = 2
+IN_USE_S = 3600
+
+
+def cached_copy(dataset, cache_dir: str = None) -> str:
+    """Path of the local copy of `dataset`, downloading it on first use."""
+    cache_dir = cache_dir or DATASET_CACHE
+    target = os.path.join(cache_dir, dataset.id)
+    marker = os.path.join(target, COMPLETE_MARKER)
+    name = f"{dataset.project}/{dataset.name}"
+    if os.path.exists(marker):
+        try:
+            write_marker(marker, name)
+        except OSError:
+            pass  # evicted meanwhile, the copy is downloaded again
+        else:
+            return target
+
+    # download next to the target and rename, so readers never see a partial copy
+    tmp = f"{target}.{os.getpid()}-{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        dataset.get_mutable_local_copy(tmp, overwrite=True)
+        write_marker(os.path.join(tmp, COMPLETE_MARKER), name)
+        if not os.path.exists(marker):
+            shutil.rmtree(target, ignore_errors=True)  # left by an interrupted run
+        os.replace(tmp, target)
+    except OSError:
+        # another process finished the same dataset first
+        if not os.path.exists(marker):
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict(cache_dir, name)
+    return target
+
+
+def write_marker(marker: str, name: str):
+    with open(marker, "w") as f:
+        f.write(name)
+
+
+def evict(cache_dir: str, name: str, keep: int = KEEP_COPIES):
+    """
+    Removes the copies of dataset `name` beyond the `keep` most recently used
+    ones. Copies used in the last IN_USE_S seconds are kept, a worker of a
+    concurrent run may still be reading them.
+    """
+    copies = []
+    for entry in os.scandir(cache_dir):
+        marker = os.path.join(entry.path, COMPLETE_MARKER)
+        try:
+            with open(marker) as f:
+                if f.read() != name:
+                    continue
+            copies.append((os.path.getmtime(marker), entry.path))
+        except OSError:
+            continue  # not a complete copy, or removed meanwhile
+    copies.sort(reverse=True)
+    for used, path in copies[keep:]:
+        if time.time() - used < IN_USE_S:
+            continue
+        # rename first, so no reader finds a half removed copy behind a marker
+        trash = f"{path}.{os.getpid()}-{threading.get_ident()}.evict"
+        try:
+            os.replace(path, trash)
+        except OSError:
+            continue
+        shutil.rmtree(trash, ignore_errors=True)
+        print(f"Evicted {os.path.basename(path)} ({name}) from the dataset cache")
+
+
+def prefetch(keys, fetch, max_workers: int = 4):
+    """
+    Yields (key, local path) for every key as soon as `fetch(key)` has
+    returned, running up to `max_workers` fetches at once in the background.
+    Used as the input of joblib.Parallel, workers start on the first
+    downloaded datasets while the others are still downloading. Keys whose
+    fetch fails are yielded with None.
+    """
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {pool.submit(fetch, key): key for key in keys}
+    try:
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                print(f"Could not fetch {key}: {e}")
+                path = None
+            yield key, path
+    finally:
+        # a consumer that stops early does not wait for the remaining downloads
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,321 @@
+import contextlib
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import decode
+from fetch_metrics import FetchMetrics, count_records
+
+# Shared HTTP layer for the EBZ endpoints: one keep-alive session, gzip
+# responses, retries with jittered exponential backoff and an optional
+# on-disk page cache.
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# base delay (seconds) of the exponential backoff
+RETRY_BACKOFF = 1.0
+
+_session = None
+_session_lock = threading.Lock()
+_in_flight = None
+_truncated = []
+_truncated_lock = threading.Lock()
+_cache = None
+metrics = FetchMetrics()
+
+
+class PageCache:
+    """
+    Raw API pages on disk, one file per (endpoint, id, query). Pages younger
+    than `max_age` seconds are served without touching the network, older
+    ones are revalidated with their ETag / Last-Modified when the server sent
+    one and refetched otherwise.
+    """
+
+    def __init__(self, root: str, max_age: float = 24 * 3600):
+        self.root = root
+        self.max_age = max_age
+
+    def _path(self, endpoint: str, series_id, params) -> str:
+        params = params or {}
+        query = json.dumps(params, sort_keys=True, default=str)
+        digest = hashlib.sha1(query.encode()).hexdigest()[:12]
+        return os.path.join(self.root, endpoint, str(series_id), f"page-{params.get('page', 1)}-{digest}")
+
+    def load(self, endpoint: str, series_id, params):
+        path = self._path(endpoint, series_id, params)
+        try:
+            with open(f"{path}.meta.json") as f:
+                meta = json.load(f)
+            with open(f"{path}.json", "rb") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None, None
+        return content, meta
+
+    def store(self, endpoint: str, series_id, params, content: bytes, headers=None):
+        path = self._path(endpoint, series_id, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        headers = headers or {}
+        meta = {
+            "params": params,
+            "fetched_at": time.time(),
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        # write-then-rename so a killed worker never leaves a half page behind
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(f"{path}.json{tmp_suffix}", "wb") as f:
+            f.write(content)
+        os.replace(f"{path}.json{tmp_suffix}", f"{path}.json")
+        with open(f"{path}.meta.json{tmp_suffix}", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.meta.json{tmp_suffix}", f"{path}.meta.json")
+
+    def touch(self, endpoint: str, series_id, params):
+        content, meta = self.load(endpoint, series_id, params)
+        if content is not None:
+            self.store(endpoint, series_id, params, content,
+                       {"ETag": meta.get("etag"), "Last-Modified": meta.get("last_modified")})
+
+    def cached_page_size(self, endpoint: str, series_id):
+        """per_page of the cached first page of a series, so a resumed fetch keeps its page layout."""
+        series_dir = os.path.join(self.root, endpoint, str(series_id))
+        try:
+            names = [name for name in os.listdir(series_dir) if name.startswith("page-1-") and name.endswith(".meta.json")]
+        except OSError:
+            return None
+        for name in names:
+            try:
+                with open(os.path.join(series_dir, name)) as f:
+                    per_page = (json.load(f).get("params") or {}).get("per_page")
+            except (OSError, ValueError):
+                continue
+            if per_page:
+                return int(per_page)
+        return None
+
+    def is_fresh(self, meta) -> bool:
+        return time.time() - meta.get("fetched_at", 0) < self.max_age
+
+
+def configure_cache(cache_dir, max_age: float = 24 * 3600):
+    """Enables the page cache under `cache_dir`, or disables it for None."""
+    global _cache
+    _cache = PageCache(cache_dir, max_age) if cache_dir else None
+    return _cache
+
+
+def get_session(pool_size: int = 16) -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                'Content-Type': 'application/json',
+                'Accept-Encoding': 'gzip, deflate',
+            })
+            _session = session
+        return _session
+
+
+def configure_session(pool_size: int, max_in_flight: int = None):
+    """
+    Recreates the shared session so the pool holds `pool_size` connections.
+    `max_in_flight` caps concurrent requests across all threads (series and
+    page level), defaulting to the pool size.
+    """
+    global _session, _in_flight
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _in_flight = threading.BoundedSemaphore(max_in_flight or pool_size)
+    return get_session(pool_size)
+
+
+def cached_page_size(endpoint: str, series_id):
+    return _cache.cached_page_size(endpoint, series_id) if _cache is not None else None
+
+
+def backoff_delay(attempt: int, backoff: float, max_delay: float = 60.0) -> float:
+    # "full jitter": uniform between 0 and the exponential cap
+    return random.uniform(0, min(max_delay, backoff * 2 ** attempt))
+
+
+def get_json(url: str, token: str, params=None, max_retries: int = 5, backoff: float = None, timeout=(5, 60),
+             endpoint: str = None, series_id=None, info: dict = None, use_cache: bool = True,
+             timeout_retries: int = None):
+    """
+    GET `url` and return the decoded JSON body, or None once the request
+    failed for good (non-retryable status or retries exhausted). Requests
+    labelled with `endpoint` and `series_id` go through the page cache
+    unless `use_cache` is False. `timeout_retries` caps the retries after
+    read timeouts separately (default `max_retries`), for callers that
+    rather ask again for a smaller page.
+    Every attempt is recorded in `metrics` under `endpoint`. If `info` is
+    given it receives elapsed time, bytes, cache_hit and timed_out of the
+    final attempt.
+    """
+    info = info if info is not None else {}
+    info.update({"elapsed": 0.0, "bytes": 0, "cache_hit": False, "timed_out": False})
+    session = get_session()
+    cache = _cache if endpoint is not None and use_cache else None
+    headers = {"Authorization": token}
+    cached = None
+    if cache is not None:
+        cached, meta = cache.load(endpoint, series_id, params)
+        if cached is not None:
+            if cache.is_fresh(meta):
+                info.update({"cache_hit": True, "bytes": len(cached)})
+                return _page(endpoint, decode.loads(cached), cache_hit=True)
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+    timeout_retries = max_retries if timeout_retries is None else timeout_retries
+    timeouts = 0
+    for attempt in range(max_retries + 1):
+        try:
+            with _in_flight if _in_flight is not None else contextlib.nullcontext():
+                # timed from here: waiting for a free slot is not server latency
+                started = time.perf_counter()
+                resp = session.get(url, headers=headers, params=params, timeout=timeout)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            info.update({"elapsed": time.perf_counter() - started, "timed_out": isinstance(e, requests.Timeout)})
+            metrics.record_request(endpoint, info["elapsed"], error=True)
+            error = f"{type(e).__name__}: {e}"
+            retry_after = None
+            timeouts += info["timed_out"]
+            if timeouts > timeout_retries:
+                break
+        else:
+            ok = 200 <= resp.status_code < 300 or resp.status_code == 304
+            # Content-Length is the wire size when the body was compressed
+            n_bytes = int(resp.headers.get("Content-Length", len(resp.content)))
+            info.update({"elapsed": time.perf_counter() - started, "bytes": n_bytes, "timed_out": False})
+            metrics.record_request(endpoint, info["elapsed"], resp.status_code, n_bytes, error=not ok)
+            if resp.status_code == 304 and cached is not None:
+                cache.touch(endpoint, series_id, params)
+                return _page(endpoint, decode.loads(cached), cache_hit=True)
+            if 200 <= resp.status_code < 300:
+                if cache is not None:
+                    cache.store(endpoint, series_id, params, resp.content, resp.headers)
+                return _page(endpoint, decode.loads(resp.content))
+            error = f"{resp.status_code} - {resp.text[:200]}"
+            if resp.status_code not in RETRY_STATUS:
+                print(f"Error fetching {url} {params}: {error}")
+                metrics.record_failure(endpoint)
+                return None
+            retry_after = resp.headers.get("Retry-After")
+
+        if attempt == max_retries:
+            break
+        delay = backoff_delay(attempt, RETRY_BACKOFF if backoff is None else backoff)
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        print(f"Retrying {url} {params} in {delay:.1f}s ({attempt + 1}/{max_retries}): {error}")
+        metrics.record_retry(endpoint)
+        time.sleep(delay)
+
+    print(f"Giving up on {url} {params} after {attempt} retries: {error}")
+    metrics.record_failure(endpoint)
+    return None
+
+
+class PageSizer:
+    """
+    Adaptive `per_page` for one endpoint: aims for requests of about
+    `target_s` seconds and at most `max_bytes`, learned from the records/s
+    and bytes/record of earlier pages. Sizes snap to PAGE_SIZES so cached
+    pages keep matching between runs.
+    """
+
+    PAGE_SIZES = [1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000]
+
+    def __init__(self, initial: int = 500000, target_s: float = 20.0, max_bytes: float = 64e6, min_records: int = 1000):
+        self.target_s = target_s
+        self.max_bytes = max_bytes
+        self.min_records = min_records
+        self._estimate = float(initial)
+        # what is known about the server's cap of per_page: its value once a
+        # capped page was seen, else the longest page known not to be capped
+        self.server_cap = None
+        self.uncapped = 0
+        self._lock = threading.Lock()
+
+    def _snap(self, value: float) -> int:
+        fitting = [size for size in self.PAGE_SIZES if size <= value]
+        return fitting[-1] if fitting else self.PAGE_SIZES[0]
+
+    def size(self) -> int:
+        with self._lock:
+            return self._snap(self._estimate)
+
+    def observe(self, records: int, elapsed: float, n_bytes: int = 0):
+        # small pages are dominated by latency and say nothing about throughput
+        if records < self.min_records or elapsed <= 0:
+            return
+        limit = records / elapsed * self.target_s
+        if n_bytes:
+            limit = min(limit, self.max_bytes * records / n_bytes)
+        with self._lock:
+            self._estimate = 0.5 * self._estimate + 0.5 * min(limit, self.PAGE_SIZES[-1])
+
+    def observe_page_length(self, records: int, capped: bool):
+        """A page of `records` was (not) cut short by the server's cap of per_page."""
+        with self._lock:
+            if capped:
+                self.server_cap = records
+            else:
+                self.uncapped = max(self.uncapped, records)
+
+    def is_last_page(self, per_page: int, records: int):
+        """
+        Whether a first page of `records` < `per_page` is the whole series:
+        True below the known cap, False at it. Without a known cap, True up
+        to the longest page known not to be capped (a series exactly as long
+        as a cap is taken for uncapped), None above it.
+        """
+        with self._lock:
+            if self.server_cap is not None:
+                return records < self.server_cap or self.server_cap >= per_page
+            return True if records <= self.uncapped else None
+
+    def observe_timeout(self, per_page: int):
+        with self._lock:
+            self._estimate = min(self._estimate, per_page / 2)
+
+
+def _page(endpoint: str, payload, cache_hit: bool = False):
+    metrics.record_page(endpoint, count_records(payload), cache_hit=cache_hit)
+    return payload
+
+
+def mark_truncated(endpoint: str, series_id: int, page=None, reason: str = ""):
+    with _truncated_lock:
+        _truncated.append({
+            "endpoint": endpoint,
+            "id": int(series_id),
+            "page": page,
+            "reason": reason,
+        })
+
+
+def reset_truncated():
+    with _truncated_lock:
+        _truncated.clear()
+
+
+def truncated_series():
+    with _truncated_lock:
+        return list(_truncated)
@@ -6,7 +6,7 @@ import os
 load_dotenv(find_dotenv())
 
 
-def main(building_id:int):
+def main(building_id:int, building_ids:str=None):
     # Load all required tokens from environment
     git_token = os.environ['GIT_OAUTH_TOKEN']
     building_token = os.environ['buildings_token']
@@ -27,14 +27,22 @@ def main(building_id:int):
         #f"--env-file {env_file_path} "
     )
 
+    # one task can fetch a whole batch of buildings, see cml_dataset.py --building_ids
+    if building_ids:
+        task_name = f"Fetch Building Data Remotely-buildings {building_ids}"
+        argparse_args = [("building_ids", building_ids)]
+    else:
+        task_name = f"Fetch Building Data Remotely-building {building_id}"
+        argparse_args = [("building_id", building_id)]
+
     #print(docker_env_args)
     task = Task.create(
         project_name="ForeSightNEXT/BaltBest",
-        task_name=f"Fetch Building Data Remotely-building {building_id}",
+        task_name=task_name,
         script = "./cml_dataset.py",
         docker="nvidia/cuda:11.8.0-cudnn8-devel-ubuntu22.04",
         docker_args=docker_env_args,
-        argparse_args=[("building_id", building_id)],
+        argparse_args=argparse_args,
 
     )
 
@@ -49,6 +57,12 @@ if __name__ == "__main__":
         default=57,
         help="specify the building id"
     )
+    parser.add_argument(
+        '--building_ids',
+        type=str,
+        default=None,
+        help="comma separated building ids / ranges (e.g. '4,10,18-21') fetched by one task"
+    )
     args = parser.parse_args()
-    print(args.building_id)
-    main(args.building_id)
\ No newline at end of file
+    print(args.building_ids or args.building_id)
+    main(args.building_id, args.building_ids)
\ No newline at end of file
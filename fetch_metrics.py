@@ -0,0 +1,136 @@
+import threading
+import time
+
+import numpy as np
+
+# Upper bounds (seconds) of the request latency histogram buckets.
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, float("inf")]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.records = 0
+        self.pages = 0
+        self.status = {}
+        self.latencies = []
+
+    def summary(self) -> dict:
+        latencies = np.array(self.latencies)
+        counts = np.histogram(latencies, bins=[0] + LATENCY_BUCKETS)[0] if len(latencies) else np.zeros(len(LATENCY_BUCKETS))
+        return {
+            "requests": self.requests,
+            "pages": self.pages,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "errors": self.errors,
+            "failed": self.failed,
+            "status": {str(k): v for k, v in sorted(self.status.items())},
+            "bytes": self.bytes,
+            "records": self.records,
+            "records_per_page": self.records / self.pages if self.pages else 0.0,
+            "latency_s": {
+                "total": float(latencies.sum()) if len(latencies) else 0.0,
+                "mean": float(latencies.mean()) if len(latencies) else 0.0,
+                "p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                "p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+                "max": float(latencies.max()) if len(latencies) else 0.0,
+            },
+            "latency_histogram": {f"le_{bound}": int(n) for bound, n in zip(LATENCY_BUCKETS, counts)},
+        }
+
+
+class FetchMetrics:
+    """Thread-safe per-endpoint counters filled by ebz_client.get_json."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.started = time.time()
+
+    def _get(self, endpoint: str) -> EndpointStats:
+        return self._stats.setdefault(endpoint or "other", EndpointStats())
+
+    def record_request(self, endpoint: str, latency: float, status=None, n_bytes: int = 0, error: bool = False):
+        with self._lock:
+            stats = self._get(endpoint)
+            stats.requests += 1
+            stats.latencies.append(latency)
+            stats.bytes += n_bytes
+            if status is not None:
+                stats.status[status] = stats.status.get(status, 0) + 1
+            if error:
+                stats.errors += 1
+
+    def record_page(self, endpoint: str, records: int, cache_hit: bool = False):
+        with self._lock:
+            stats = self._get(endpoint)
+            stats.pages += 1
+            stats.records += records
+            if cache_hit:
+                stats.cache_hits += 1
+
+    def record_retry(self, endpoint: str):
+        with self._lock:
+            self._get(endpoint).retries += 1
+
+    def record_failure(self, endpoint: str):
+        with self._lock:
+            self._get(endpoint).failed += 1
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self.started = time.time()
+
+    def summary(self) -> dict:
+        with self._lock:
+            endpoints = {name: stats.summary() for name, stats in sorted(self._stats.items())}
+            elapsed = time.time() - self.started
+        total_records = sum(e["records"] for e in endpoints.values())
+        total_bytes = sum(e["bytes"] for e in endpoints.values())
+        return {
+            "elapsed_s": elapsed,
+            "records": total_records,
+            "bytes": total_bytes,
+            "records_per_s": total_records / elapsed if elapsed else 0.0,
+            "bytes_per_s": total_bytes / elapsed if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def count_records(payload) -> int:
+    if isinstance(payload, dict):
+        return len(payload.get("data", []))
+    if isinstance(payload, list):
+        return len(payload)
+    return 0
+
+
+def report_to_clearml(summary: dict, title: str = "fetch"):
+    """Logs the summary as scalars / histograms of the current ClearML task, if any."""
+    from clearml import Task
+
+    task = Task.current_task()
+    if task is None:
+        return
+    logger = task.get_logger()
+    for key in ["elapsed_s", "records", "bytes", "records_per_s", "bytes_per_s"]:
+        logger.report_scalar(title=title, series=key, value=summary[key], iteration=0)
+    for endpoint, stats in summary["endpoints"].items():
+        for key in ["requests", "pages", "cache_hits", "retries", "errors", "failed", "bytes", "records", "records_per_page"]:
+            logger.report_scalar(title=f"{title}/{endpoint}", series=key, value=stats[key], iteration=0)
+        for key, value in stats["latency_s"].items():
+            logger.report_scalar(title=f"{title}/{endpoint}/latency_s", series=key, value=value, iteration=0)
+        logger.report_histogram(
+            title=f"{title}/{endpoint}/latency_histogram",
+            series="requests",
+            values=list(stats["latency_histogram"].values()),
+            xlabels=list(stats["latency_histogram"].keys()),
+            iteration=0,
+        )
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from metadata_index import CACHE_DIR
+
+# Coordinates per city and hourly outside temperature per point, kept in one
+# SQLite file under CACHE_DIR. SQLite serialises the writers, so the joblib
+# workers of resample_remote can share it. Weather is stored per day and only
+# missing days are fetched; the most recent days are refetched until the
+# source has stopped revising them.
+
+CACHE_FILE = os.path.join(CACHE_DIR, "geo_weather.sqlite")
+FINAL_AFTER = pd.Timedelta(days=7)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocode (city TEXT PRIMARY KEY, latitude REAL, longitude REAL, fetched_at REAL);
+CREATE TABLE IF NOT EXISTS weather (latitude REAL, longitude REAL, ts INTEGER, outside_temp REAL,
+                                    PRIMARY KEY (latitude, longitude, ts));
+CREATE TABLE IF NOT EXISTS weather_days (latitude REAL, longitude REAL, day INTEGER,
+                                         PRIMARY KEY (latitude, longitude, day));
+"""
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = path or CACHE_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    con = sqlite3.connect(path, timeout=120)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.executescript(SCHEMA)
+    return con
+
+
+def point_key(latitude: float, longitude: float):
+    # about 10 m, enough to make float noise from the geocoder hit the same rows
+    return round(float(latitude), 4), round(float(longitude), 4)
+
+
+def cached_coordinates(cities, geocode, path: str = None) -> dict:
+    """
+    {city: {"latitude", "longitude"}} for `cities`, calling `geocode(city)`
+    only for cities not cached yet. It returns (latitude, longitude) or None
+    for unknown places; unknown places are cached as well. If it raises
+    (timeout, offline) nothing is cached and the city is left out.
+    """
+    con = connect(path)
+    try:
+        cached = {
+            city: (latitude, longitude)
+            for city, latitude, longitude in con.execute("SELECT city, latitude, longitude FROM geocode")
+        }
+        geo_data = {}
+        for city in cities:
+            if city not in cached:
+                try:
+                    location = geocode(city)
+                except Exception as e:
+                    print(f"Could not geocode {city}: {e}")
+                    continue
+                cached[city] = location if location is not None else (None, None)
+                with con:
+                    con.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)", (city, *cached[city], time.time()))
+            latitude, longitude = cached[city]
+            if latitude is not None:
+                geo_data[city] = {"latitude": latitude, "longitude": longitude}
+        return geo_data
+    finally:
+        con.close()
+
+
+def missing_ranges(days: np.ndarray, covered: set) -> list:
+    """Contiguous runs of `days` (day numbers since epoch) not in `covered`, as (first, last) pairs."""
+    missing = [day for day in days if day not in covered]
+    ranges = []
+    for day in missing:
+        if ranges and day == ranges[-1][1] + 1:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+
+def cached_hourly_temperature(latitude: float, longitude: float, start: pd.Timestamp, end: pd.Timestamp, fetch,
+                              path: str = None) -> pd.DataFrame:
+    """
+    Hourly outside temperature (columns ts, outside_temp) at the point for
+    naive UTC `start` .. `end` inclusive. `fetch(latitude, longitude, start,
+    end)` is called once per run of uncached days and returns the same
+    columns with UTC `ts`.
+    """
+    latitude, longitude = point_key(latitude, longitude)
+    day = pd.Timedelta(days=1)
+    epoch = pd.Timestamp(0)
+    days = np.arange((start.floor("D") - epoch) // day, (end.floor("D") - epoch) // day + 1)
+    final_before = (pd.Timestamp.now(tz="UTC").tz_localize(None).floor("D") - FINAL_AFTER - epoch) // day
+
+    con = connect(path)
+    try:
+        covered = {
+            row[0] for row in con.execute(
+                "SELECT day FROM weather_days WHERE latitude = ? AND longitude = ? AND day BETWEEN ? AND ?",
+                (latitude, longitude, int(days[0]), int(days[-1])),
+            )
+        }
+        for first, last in missing_ranges(days, covered):
+            try:
+                fetched = fetch(latitude, longitude, epoch + first * day, epoch + last * day + pd.Timedelta(hours=23))
+            except Exception as e:
+                # offline: serve whatever is cached for these days
+                print(f"Could not fetch weather at {latitude}, {longitude} for days {first}..{last}: {e}")
+                continue
+            seconds = (fetched["ts"].dt.tz_convert(None) - epoch) // pd.Timedelta(seconds=1)
+            rows = [
+                (latitude, longitude, int(ts), None if pd.isna(value) else float(value))
+                for ts, value in zip(seconds, fetched["outside_temp"])
+            ]
+            final_days = [(latitude, longitude, int(d)) for d in range(first, last + 1) if d < final_before]
+            with con:
+                con.executemany("INSERT OR REPLACE INTO weather VALUES (?, ?, ?, ?)", rows)
+                con.executemany("INSERT OR REPLACE INTO weather_days VALUES (?, ?, ?)", final_days)
+
+        first_s = (start - epoch) // pd.Timedelta(seconds=1)
+        last_s = (end - epoch) // pd.Timedelta(seconds=1)
+        weather = pd.read_sql_query(
+            "SELECT ts, outside_temp FROM weather WHERE latitude = ? AND longitude = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            con,
+            params=(latitude, longitude, int(first_s), int(last_s)),
+        )
+    finally:
+        con.close()
+    weather["ts"] = pd.to_datetime(weather["ts"], unit="s", utc=True).dt.as_unit("us")
+    weather["outside_temp"] = weather["outside_temp"].astype("float64")
+    return weather
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# Hourly means of many series at once. Equivalent to
+#   df.set_index('ts').groupby(id_col)[columns].resample('h').mean()
+# but bins all ids in one pass over integer timestamps instead of building
+# one resampler per id.
+
+ENGINES = ["numpy", "pandas"]
+
+
+def hourly_mean_pandas(df: pd.DataFrame, id_col: str, columns: list) -> pd.DataFrame:
+    return df.set_index('ts').groupby(id_col)[columns].resample('h').mean()
+
+
+def hourly_mean(df: pd.DataFrame, id_col: str, columns: list, engine: str = "numpy") -> pd.DataFrame:
+    """
+    Mean of `columns` per id and hour with the layout of the pandas path:
+    a (id_col, ts) MultiIndex sorted by id, with every hour between the first
+    and last sample of an id present (NaN where it has no samples).
+    `df['ts']` must already be datetimes, naive or UTC; other time zones
+    go through pandas.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown resample engine {engine!r}, expected one of {ENGINES}")
+    if engine == "pandas" or df.empty or str(df['ts'].dt.tz or "UTC") != "UTC":
+        return hourly_mean_pandas(df, id_col, columns)
+
+    ts = df['ts']
+    unit, tz = ts.dt.unit, ts.dt.tz
+    hour = int(pd.Timedelta(hours=1) / pd.Timedelta(1, unit=unit))
+
+    keep = ts.notna().to_numpy() & df[id_col].notna().to_numpy()
+    ids = df[id_col].to_numpy()[keep]
+    bins = np.floor_divide(pd.DatetimeIndex(ts).asi8[keep], hour)
+
+    uniq, codes = np.unique(ids, return_inverse=True)
+    first = np.full(len(uniq), np.iinfo(np.int64).max)
+    last = np.full(len(uniq), np.iinfo(np.int64).min)
+    np.minimum.at(first, codes, bins)
+    np.maximum.at(last, codes, bins)
+
+    # every id owns a contiguous run of hours from its first to its last bin
+    n_bins = last - first + 1
+    offsets = np.concatenate([[0], np.cumsum(n_bins)[:-1]])
+    slot = offsets[codes] + (bins - first[codes])
+    total = int(n_bins.sum())
+
+    result = {}
+    for column in columns:
+        values = df[column].to_numpy(dtype=np.float64)[keep]
+        valid = ~np.isnan(values)
+        sums = np.bincount(slot[valid], weights=values[valid], minlength=total)
+        counts = np.bincount(slot[valid], minlength=total)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[column] = np.where(counts > 0, sums / counts, np.nan)
+
+    owner = np.repeat(np.arange(len(uniq)), n_bins)
+    hours = first[owner] + (np.arange(total) - offsets[owner])
+    hour_index = pd.DatetimeIndex((hours * hour).view(f"datetime64[{unit}]"))
+    hour_index = hour_index.tz_localize(tz) if tz is not None else hour_index
+    index = pd.MultiIndex.from_arrays([uniq[owner], hour_index], names=[id_col, 'ts'])
+    return pd.DataFrame(result, index=index, columns=columns)
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import pickle
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.environ.get("API_FETCH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "api_fetch"))
+
+METADATA_FILES = ["building_metadata.csv", "rooms_metadata.csv", "hca_metadata.csv"]
+
+
+def _group(df: pd.DataFrame, key: str, value: str) -> dict:
+    # unique values per key, in order of first appearance like Series.unique()
+    return {k: v.unique() for k, v in df.groupby(key, sort=False)[value]}
+
+
+class MetadataIndex:
+    """
+    Building -> units -> rooms -> HCAs lookups over the EBZ metadata CSVs,
+    built once so the fetch, resample and QA loops do not re-filter them.
+    """
+
+    def __init__(self, buildings: pd.DataFrame, rooms: pd.DataFrame, hcas: pd.DataFrame):
+        self.buildings = buildings
+        self.rooms = rooms
+        self.hcas = hcas
+        self._rooms_by_building = _group(rooms, 'building_id', 'room_id')
+        self._units_by_building = _group(rooms, 'building_id', 'unit_id')
+        self._rooms_by_unit = _group(rooms, 'unit_id', 'room_id')
+        self._hcas_by_room = _group(hcas, 'room_id', 'heat_cost_allocator_id')
+        self._building_of_room = dict(zip(rooms['room_id'], rooms['building_id']))
+        self._city = dict(zip(buildings['building_id'], buildings['city'])) if 'city' in buildings else {}
+        self._coefficients = (
+            hcas.drop_duplicates('heat_cost_allocator_id')
+            .set_index('heat_cost_allocator_id')[['room_id', 'kcl', 'kcw', 'qs']]
+        )
+
+    @classmethod
+    def from_csv(cls, path: str = "metadata") -> "MetadataIndex":
+        building_file = os.path.join(path, "building_metadata.csv")
+        buildings = pd.read_csv(building_file) if os.path.exists(building_file) else pd.DataFrame(columns=['building_id'])
+        rooms = pd.read_csv(os.path.join(path, "rooms_metadata.csv"))
+        hcas = pd.read_csv(os.path.join(path, "hca_metadata.csv"))
+        return cls(buildings, rooms, hcas)
+
+    def building_ids(self) -> list:
+        return list(self._rooms_by_building)
+
+    def rooms_of_building(self, building_id: int) -> np.ndarray:
+        return self._rooms_by_building.get(building_id, np.array([], dtype=np.int64))
+
+    def units_of_building(self, building_id: int) -> np.ndarray:
+        return self._units_by_building.get(building_id, np.array([], dtype=np.int64))
+
+    def rooms_of_unit(self, unit_id: int) -> np.ndarray:
+        return self._rooms_by_unit.get(unit_id, np.array([], dtype=np.int64))
+
+    def hcas_of_room(self, room_id: int) -> np.ndarray:
+        return self._hcas_by_room.get(room_id, np.array([], dtype=np.int64))
+
+    def hcas_of_rooms(self, room_ids) -> np.ndarray:
+        hcas = [self.hcas_of_room(room_id) for room_id in room_ids]
+        return np.concatenate(hcas) if hcas else np.array([], dtype=np.int64)
+
+    def hcas_of_building(self, building_id: int) -> np.ndarray:
+        return self.hcas_of_rooms(self.rooms_of_building(building_id))
+
+    def building_of_room(self, room_id: int):
+        return self._building_of_room.get(room_id)
+
+    def city(self, building_id: int):
+        return self._city.get(building_id)
+
+    def retired_hcas(self, before) -> set:
+        """Inactive HCAs removed before `before`; they cannot deliver new data."""
+        hcas = self.hcas
+        if 'active' not in hcas or 'date_removal' not in hcas:
+            return set()
+        removed = pd.to_datetime(hcas['date_removal'], utc=True, errors='coerce')
+        retired = ~hcas['active'].astype(bool) & (removed < pd.to_datetime(before, utc=True))
+        return set(hcas.loc[retired, 'heat_cost_allocator_id'].tolist())
+
+    def building_digest(self, building_id: int) -> str:
+        """Hash of the rooms and HCA rows of a building, changes when its metadata does."""
+        rooms = self.rooms[self.rooms['building_id'] == building_id]
+        hcas = self.hcas[self.hcas['room_id'].isin(rooms['room_id'])]
+        digest = hashlib.sha1()
+        for df in [rooms, hcas]:
+            digest.update(df.sort_values(list(df.columns)).to_csv(index=False).encode())
+        return digest.hexdigest()[:16]
+
+    def coefficients(self) -> pd.DataFrame:
+        """room_id, kcl, kcw and qs indexed by heat_cost_allocator_id."""
+        return self._coefficients
+
+    def hca_table(self) -> pd.DataFrame:
+        """One row per HCA with its room, unit and building."""
+        rooms = self.rooms[['room_id', 'unit_id', 'building_id']].drop_duplicates('room_id')
+        return self.hcas.merge(rooms, on='room_id', how='inner')
+
+
+def _content_key(path: str) -> str:
+    digest = hashlib.sha1()
+    for name in METADATA_FILES:
+        file = os.path.join(path, name)
+        if os.path.exists(file):
+            with open(file, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def hca_lookup_file(path: str = "metadata") -> str:
+    """
+    .npy file mapping HCA ids to their room (row 0) and building (row 1),
+    -1 for unknown ids, for the metadata CSVs in `path`. Written once per
+    metadata content under CACHE_DIR; workers np.load it with mmap_mode='r'
+    and join by indexing instead of re-reading and merging the CSVs.
+    """
+    lookup_file = os.path.join(CACHE_DIR, f"hca_lookup-{_content_key(path)}.npy")
+    if os.path.exists(lookup_file):
+        return lookup_file
+
+    table = load_index(path).hca_table().drop_duplicates('heat_cost_allocator_id')
+    table = table[table['heat_cost_allocator_id'] >= 0]
+    ids = table['heat_cost_allocator_id'].to_numpy(dtype=np.int64)
+    lookup = np.full((2, ids.max() + 1 if len(ids) else 0), -1, dtype=np.int32)
+    lookup[0, ids] = table['room_id'].to_numpy()
+    lookup[1, ids] = table['building_id'].to_numpy()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = f"{lookup_file}.{os.getpid()}.tmp.npy"
+    np.save(tmp_file, lookup)
+    os.replace(tmp_file, lookup_file)
+    return lookup_file
+
+
+@lru_cache(maxsize=None)
+def load_index(path: str = "metadata") -> MetadataIndex:
+    """
+    Returns the index of the metadata CSVs in `path`, loaded at most once per
+    process and pickled under CACHE_DIR keyed by the CSV contents, so every
+    dataset copy of the same metadata shares one cache entry.
+    """
+    cache_file = os.path.join(CACHE_DIR, f"metadata_index-{_content_key(path)}.pkl")
+    try:
+        with open(cache_file, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        pass
+
+    index = MetadataIndex.from_csv(path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Could not cache metadata index: {e}")
+    return index
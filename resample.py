@@ -5,9 +5,20 @@ from geopy.extra.rate_limiter import RateLimiter
 from typing import List
 from meteostat import Point, Daily, Hourly
 from clearml import Task, Dataset
+import json
 import os
+import shutil
+import tempfile
 from joblib import Parallel, delayed
 
+import dataset_cache
+import geo_cache
+import schema
+import storage
+from cml_dataset import get_fingerprint, latest_building_dataset, load_fetch_state
+from hourly import hourly_mean
+from metadata_index import hca_lookup_file, load_index
+
 def calculate_hi_res_roomwise(df_htd, df_hca):
 
 
@@ -54,53 +65,161 @@ def calculate_hi_res_roomwise(df_htd, df_hca):
     #result = df[['heat_cost_allocator_id', 'ts','temperature_1','temperature_2', 'q_hkv_dt','room_id','outside_temp']]
     return result
 
-def geocoding(cities:List[str]):
-    geo_data = {}
+def precompute_coefficients(df_hca:pd.DataFrame):
+    """
+    Per-HCA constants of the heat unit formula, sorted by id for lookups:
+    qs * (kcw * kcl * dT / 60) ** 1.3 * dt / 1000 == k * dT ** 1.3 * dt
+    with k = qs * (kcw * kcl / 60) ** 1.3 / 1000.
+    """
+    df_hca = df_hca.drop_duplicates('heat_cost_allocator_id').sort_values('heat_cost_allocator_id')
+    return {
+        'ids': df_hca['heat_cost_allocator_id'].to_numpy(dtype=np.int64),
+        'room_id': df_hca['room_id'].to_numpy(),
+        'k': (df_hca['qs'] * np.power(df_hca['kcw'] * df_hca['kcl'] / 60.0, 1.3) / 1000.0).to_numpy(dtype=np.float64),
+        'frame': df_hca,
+    }
+
+def sort_order(major:np.ndarray, minor:np.ndarray) -> np.ndarray:
+    """
+    Stable order of rows by (major, minor), like np.lexsort((minor, major)).
+    When both fit into one int64 key a single stable argsort is used, which
+    is close to linear on the already sorted runs of per-series data.
+    """
+    if not len(major):
+        return np.arange(0)
+    major, minor = major.astype(np.int64, copy=False), minor.astype(np.int64, copy=False)
+    major_min, minor_min = int(major.min()), int(minor.min())
+    span = int(minor.max()) - minor_min + 1
+    if (int(major.max()) - major_min + 1) * span >= 2 ** 62:
+        return np.lexsort((minor, major))
+    return np.argsort((major - major_min) * span + (minor - minor_min), kind='stable')
+
+def is_sorted(major:np.ndarray, minor:np.ndarray) -> bool:
+    same = major[1:] == major[:-1]
+    return bool(((major[1:] > major[:-1]) | (same & (minor[1:] >= minor[:-1]))).all())
+
+def calculate_hi_res_fast(df_htd:pd.DataFrame, coefficients:dict, dtype=np.float64):
+    """
+    calculate_hi_res_roomwise on numpy arrays: coefficients come from
+    precompute_coefficients and are looked up by id instead of merged, dt
+    is taken from the sorted int64 timestamps and the (room_id, ts)
+    aggregation runs on sorted keys. dtype=np.float32 trades precision of
+    the measurement columns for memory and speed.
+    """
+    ts = schema.parse_ts(df_htd["ts"])
+    unit = ts.dt.unit
+    hour = int(pd.Timedelta(hours=1) / pd.Timedelta(1, unit=unit))
+    nat = ts.isna().to_numpy()
+    ts_values = pd.DatetimeIndex(ts).asi8
+    ids = df_htd['heat_cost_allocator_id'].to_numpy(dtype=np.int64)
+
+    t1 = df_htd['temperature_1'].to_numpy(dtype=dtype)
+    t2 = df_htd['temperature_2'].to_numpy(dtype=dtype)
+    outside = df_htd['outside_temp'].to_numpy(dtype=dtype)
+
+    # sorted like sort_values(['heat_cost_allocator_id', 'ts']), NaT last;
+    # hca_resample output already is, then the gathers are skipped
+    minor = np.where(nat, ts_values.max(initial=0) + 1, ts_values)
+    if not is_sorted(ids, minor):
+        order = sort_order(ids, minor)
+        ids, ts_values, nat = ids[order], ts_values[order], nat[order]
+        t1, t2, outside = t1[order], t2[order], outside[order]
+
+    # hours since the previous sample of the same HCA
+    dt = np.full(len(ids), np.nan, dtype=dtype)
+    dt[1:] = np.diff(ts_values) / hour
+    dt[1:][(ids[1:] != ids[:-1]) | nat[1:] | nat[:-1]] = np.nan
+
+    # rows are grouped by HCA now, so the coefficients are looked up once per HCA
+    blocks = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]])) if len(ids) else np.arange(0)
+    block_ids = ids[blocks]
+    lookup = np.minimum(np.searchsorted(coefficients['ids'], block_ids), len(coefficients['ids']) - 1)
+    block_found = coefficients['ids'][lookup] == block_ids
+    lengths = np.diff(np.append(blocks, len(ids)))
+    found = np.repeat(block_found, lengths)
+    k = np.repeat(np.where(block_found, coefficients['k'][lookup], np.nan).astype(dtype), lengths)
+
+    with np.errstate(invalid='ignore'):
+        delta = t2 - t1
+        heating = delta > 3
+        q = np.power(delta, dtype(1.3))
+    q *= k
+    q *= dt
+    q[~heating] = 0.0
+
+    # group by (room_id, ts); like groupby, rows without a room or a timestamp are dropped
+    keep = found & ~nat
+    room = np.repeat(coefficients['room_id'][lookup], lengths)[keep]
+    ts_values = ts_values[keep]
+    order = sort_order(room, ts_values)
+    room, ts_values = room[order], ts_values[order]
+    new_key = np.ones(len(room), dtype=bool)
+    new_key[1:] = (room[1:] != room[:-1]) | (ts_values[1:] != ts_values[:-1])
+    starts = np.flatnonzero(new_key)
+    take = np.flatnonzero(keep)[order]
+
+    def reduce(ufunc, values):
+        values = values[take]
+        return ufunc.reduceat(values, starts) if len(starts) else values
+
+    outside_valid = ~np.isnan(outside)
+    counts = reduce(np.add, outside_valid.astype(np.int64))
+    outside_sum = reduce(np.add, np.where(outside_valid, outside, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outside_mean = np.where(counts > 0, outside_sum / counts, np.nan).astype(dtype)
+
+    return pd.DataFrame({
+        # room_id turns float like after the left merge when an HCA has no metadata
+        'room_id': room[starts] if found.all() else room[starts].astype(np.float64),
+        'ts': pd.DatetimeIndex(ts_values[starts].view(f"datetime64[{unit}]")).tz_localize("UTC"),
+        'temperature_1': reduce(np.fmax, t1),
+        'temperature_2': reduce(np.fmax, t2),
+        'q_hkv_dt': reduce(np.add, np.nan_to_num(q, nan=0.0, posinf=np.inf, neginf=-np.inf)),
+        'outside_temp': outside_mean,
+    })
 
+def geocoding(cities:List[str]):
+    # only cities missing from the geo cache hit Nominatim
     geolocator = Nominatim(user_agent="agent")
     geocode = RateLimiter(
         geolocator.geocode,
         min_delay_seconds=1.1,
         max_retries=2,
-        error_wait_seconds=5
+        error_wait_seconds=5,
+        # a timeout must not look like an unknown city, that would be cached
+        swallow_exceptions=False
     )
 
-    for city in cities:
+    def lookup(city):
         location = geocode(f"{city}, Germany", timeout=10)
 
         if location is None:
-            continue
+            return None
+        return location.latitude, location.longitude
 
-        geo_data[city] = {
-            "latitude": location.latitude,
-            "longitude": location.longitude
-        }
+    return geo_cache.cached_coordinates(cities, lookup)
 
-    return geo_data
-
-def fetch_meteodata(latitude, longitude,start: pd.Timestamp, end: pd.Timestamp):
+def fetch_meteostat(latitude, longitude,start: pd.Timestamp, end: pd.Timestamp):
     location = Point(latitude, longitude)
     meteo_data = Hourly(location, start=start, end=end).fetch()
     meteo_data = meteo_data.reset_index()
     meteo_data = meteo_data[["time","temp"]]
     meteo_data = meteo_data.rename(columns={"time":"ts","temp":"outside_temp"})
-    meteo_data["ts"] = pd.to_datetime(meteo_data["ts"], utc=True)
+    meteo_data["ts"] = schema.parse_ts(meteo_data["ts"])
 
     return meteo_data
 
-def alloc_resample(df):
-    df['ts'] = pd.to_datetime(df['ts'], utc=True)
-    hourly_alloc = (
-        df
-        .set_index('ts')
-        .groupby('heat_cost_allocator_id')[['temperature_1', 'temperature_2']]
-        .resample('h')
-        .mean()
-    )
+def fetch_meteodata(latitude, longitude,start: pd.Timestamp, end: pd.Timestamp):
+    # served from the weather cache, Meteostat is asked for missing days only
+    return geo_cache.cached_hourly_temperature(latitude, longitude, start, end, fetch_meteostat)
+
+def alloc_resample(df, engine:str="numpy"):
+    df['ts'] = schema.parse_ts(df['ts'])
+    hourly_alloc = hourly_mean(df, 'heat_cost_allocator_id', ['temperature_1', 'temperature_2'], engine=engine)
     return hourly_alloc
 
-def room_resample(df):
-    df['ts'] = pd.to_datetime(df['ts'], utc=True)
+def room_resample(df, engine:str="numpy"):
+    df['ts'] = schema.parse_ts(df['ts'])
     
     #
     #city = building_metadata[building_metadata['building_id']==building_id]['city'].values[0]
@@ -108,19 +227,13 @@ def room_resample(df):
     #meteo_data = fetch_meteodata(latitude, longitude, start, end)
     #print(f"meteo_data head: {meteo_data.head()}")
     #print(f"room data head: {df.head()}")
-    hourly_room = (
-        df
-        .set_index('ts')
-        .groupby('room_id')[['temperature']]
-        .resample('h')
-        .mean()
-    )
+    hourly_room = hourly_mean(df, 'room_id', ['temperature'], engine=engine)
     #hourly_room = hourly_room.join(meteo_data.set_index('ts'), how='left')
     return hourly_room
 
-def hca_resample(df, building_id:int,building_metadata:pd.DataFrame):
+def hca_resample(df, building_id:int,building_metadata:pd.DataFrame, engine:str="numpy"):
 
-    df['ts'] = pd.to_datetime(df['ts'], utc=True)
+    df['ts'] = schema.parse_ts(df['ts'])
     start = (
         df["ts"]
         .min()
@@ -137,53 +250,46 @@ def hca_resample(df, building_id:int,building_metadata:pd.DataFrame):
         .ceil("D")
     )
 
-    geo_data = geocoding(building_metadata['city'].unique().tolist())
     city = building_metadata[building_metadata['building_id']==building_id]['city'].values[0]
+    geo_data = geocoding([city])
     latitude,longitude = geo_data[city]['latitude'], geo_data[city]['longitude']
     meteo_data = fetch_meteodata(latitude, longitude, start, end)
     print(f"meteo_data head: {meteo_data.head()}")
     
-    hourly_alloc = (
-        df
-        .set_index('ts')
-        .groupby('heat_cost_allocator_id')[['temperature_1','temperature_2']]
-        .resample('h')
-        .mean()
-    )
+    hourly_alloc = hourly_mean(df, 'heat_cost_allocator_id', ['temperature_1','temperature_2'], engine=engine)
     hourly_alloc = hourly_alloc.join(meteo_data.set_index('ts'), how='left')
     return hourly_alloc
 
 def clean_df(df):
     return df.loc[:,~df.columns.str.contains('^Unnamed')]
 
-def main(building_id:int):
-
-    #building_id = 13
-    local_path = get_local_copy(building_id)
-    building_metadata = pd.read_csv(f"{local_path}/building_metadata.csv")
+# column order of the resampled output, fixed so per-room chunks line up
+OUTPUT_COLUMNS = ['room_id', 'ts', 'room_side_hca_temp', 'heater_side_hca_temp', 'hca_units', 'outside_temp', 'inside_temp', 'building_id']
 
+def resample_frames(df_room, df_hca, building_id:int, building_metadata:pd.DataFrame, coefficients:dict, engine:str="numpy", dtype=np.float64):
+    """
+    Hourly room temperature, HCA temperatures, units and outside temperature
+    of raw room / HCA series. `coefficients` comes from precompute_coefficients.
+    """
     # Room data resampling and merging with meteodata
-    try:
-        df_room = pd.read_csv(f"{local_path}/building-{building_id}/room_temp_ts.csv", compression='gzip')
-    except Exception:
-        df_room = pd.read_csv(f"{local_path}/building-{building_id}/room_temp_ts.csv")
-
-    df_room_resampled = room_resample(df_room)
+    df_room_resampled = room_resample(df_room, engine=engine)
     df_room_resampled.reset_index(inplace=True)
-    hca_metadata = pd.read_csv(f"{local_path}/hca_metadata.csv")
-    
-    print(df_room_resampled.head())
 
     # HCA data resampling and hi-res unit calculation
-    try:
-        df_hca = pd.read_csv(f"{local_path}/building-{building_id}/allocator_ts.csv", compression='gzip')
-    except Exception:
-        df_hca = pd.read_csv(f"{local_path}/building-{building_id}/allocator_ts.csv")
-        
-    df_hca_resampled = hca_resample(df_hca,building_id=building_id, building_metadata=building_metadata)
-    
-    #df_units = pd.read_csv(f"{local_path}/building-{building_id}/units_ts.csv", compression='gzip',index_col=0)
-    df_units_resampled = calculate_hi_res_roomwise(df_hca_resampled.reset_index(), hca_metadata)
+    if df_hca.empty:
+        # rooms without HCA data still get their inside temperature
+        df_units_resampled = pd.DataFrame({
+            'room_id': pd.Series(dtype=df_room_resampled['room_id'].dtype),
+            'ts': pd.Series(dtype=df_room_resampled['ts'].dtype),
+            **{col: pd.Series(dtype='float64') for col in ['temperature_1', 'temperature_2', 'q_hkv_dt', 'outside_temp']},
+        })
+    else:
+        df_hca_resampled = hca_resample(df_hca,building_id=building_id, building_metadata=building_metadata, engine=engine)
+        #df_units = pd.read_csv(f"{local_path}/building-{building_id}/units_ts.csv", compression='gzip',index_col=0)
+        if engine == "pandas":
+            df_units_resampled = calculate_hi_res_roomwise(df_hca_resampled.reset_index(), coefficients['frame'])
+        else:
+            df_units_resampled = calculate_hi_res_fast(df_hca_resampled.reset_index(), coefficients, dtype=dtype)
 
 
     df_room_resampled.set_index(['room_id','ts'],inplace=True)
@@ -191,8 +297,6 @@ def main(building_id:int):
     combined = df_units_resampled.set_index(['room_id','ts']).join(df_room_resampled, how='outer')
     combined.sort_index(level=['room_id','ts'], inplace=True)
 
-    print(combined.head())
-
     #combined = combined.join(df_hca_resampled, how='outer')
     combined.rename(columns={'q_hkv_dt':'hca_units',
                                 'temperature':'inside_temp',
@@ -200,14 +304,165 @@ def main(building_id:int):
                                 'temperature_1':'room_side_hca_temp',
                                 'outside_temp':'outside_temp'
                                 }, inplace=True)
-    print(f"final combined.head():\n{combined.head()}")
-    print(f"rooms present in building {building_id}: {combined.index.get_level_values('room_id').nunique()}")
     combined['building_id'] = building_id
     combined.reset_index(inplace=True)
-    print(f"rooms present in building {building_id}: {combined['room_id'].nunique()}")
     combined = clean_df(combined)
+    return schema.apply(combined)
+
+def main(building_id:int, room_ids=None, engine:str="numpy", local_path:str=None, dtype=np.float64):
+
+    #building_id = 13
+    local_path = local_path or get_local_copy(building_id)
+    index = load_index(local_path)
+    building_metadata = index.buildings
+    building_path = f"{local_path}/building-{building_id}"
+
+    df_room = storage.read_table(building_path, "room_temp_ts", columns=['room_id', 'ts', 'temperature'], ids=room_ids)
+    print(df_room.head())
+
+    hca_ids = None
+    if room_ids is not None:
+        hca_ids = index.hcas_of_rooms(room_ids)
+    df_hca = storage.read_table(building_path, "allocator_ts",
+                                columns=['heat_cost_allocator_id', 'ts', 'temperature_1', 'temperature_2'], ids=hca_ids)
+
+    coefficients = precompute_coefficients(index.coefficients().reset_index())
+    combined = resample_frames(df_room, df_hca, building_id, building_metadata, coefficients, engine=engine, dtype=dtype)
+    print(f"final combined.head():\n{combined.head()}")
+    print(f"rooms present in building {building_id}: {combined['room_id'].nunique()}")
     return combined
 
+def main_chunked(building_id:int, output, engine:str="numpy", local_path:str=None, spill_dir:str=None, dtype=np.float64):
+    """
+    Out-of-core variant of main: resamples one room (with its HCAs) at a
+    time and appends it to `output`, a CSV file path or a page writer
+    (storage.CsvPageWriter, storage.PartitionPageWriter), so peak memory follows the
+    largest room instead of the building. CSV tables are first rewritten
+    as Parquet partitions per series under `spill_dir` (a temporary
+    directory by default) so a room can be read without the rest.
+    Returns the number of rows written.
+    """
+    local_path = local_path or get_local_copy(building_id)
+    index = load_index(local_path)
+    building_path = f"{local_path}/building-{building_id}"
+    coefficients = precompute_coefficients(index.coefficients().reset_index())
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        room_path = storage.spill_table(building_path, "room_temp_ts", tmp_dir, building_id, columns=['room_id', 'ts', 'temperature'])
+        hca_path = storage.spill_table(building_path, "allocator_ts", tmp_dir, building_id,
+                                       columns=['heat_cost_allocator_id', 'ts', 'temperature_1', 'temperature_2'])
+
+        writer = storage.CsvPageWriter(output) if isinstance(output, str) else output
+        with writer:
+            for room_id in sorted(index.rooms_of_building(building_id)):
+                df_room = storage.read_table(room_path, "room_temp_ts", columns=['room_id', 'ts', 'temperature'], ids=[room_id])
+                df_hca = storage.read_table(hca_path, "allocator_ts",
+                                            columns=['heat_cost_allocator_id', 'ts', 'temperature_1', 'temperature_2'],
+                                            ids=index.hcas_of_room(room_id))
+                if df_room.empty and df_hca.empty:
+                    continue
+                combined = resample_frames(df_room, df_hca, building_id, index.buildings, coefficients, engine=engine, dtype=dtype)
+                writer.write(combined.reindex(columns=OUTPUT_COLUMNS))
+            rows = writer.rows
+    print(f"Resampled building {building_id} room by room: {rows} rows")
+    return rows
+
+# raw data read before the first hour to recompute, to find the sample preceding it
+OVERLAP_WINDOW = pd.Timedelta(days=1)
+
+def read_recent(building_path:str, table:str, columns:list, cutoffs:pd.Series):
+    """
+    Raw samples of the series in `cutoffs` (series id -> first hour to
+    recompute, NaT for the whole history) from that hour on, plus the last
+    sample before it, so the hourly range and `dt` of the series continue
+    exactly where the earlier output stopped.
+    """
+    id_col = storage.SERIES_ID[table]
+    known = cutoffs.dropna()
+    since = None
+    if len(known) and os.path.isdir(os.path.join(building_path, table)):
+        # Parquet: only the samples from shortly before the earliest cutoff are read
+        since = known.min() - OVERLAP_WINDOW
+    df = storage.read_table(building_path, table, columns=columns, ids=cutoffs.index if since is None else known.index, since=since)
+    if since is not None:
+        before = df['ts'] < df[id_col].map(known)
+        # new samples but none inside the window before the cutoff: the preceding one is older
+        older = np.setdiff1d(df.loc[~before, id_col].unique(), df.loc[before, id_col].unique())
+        whole = cutoffs.index[cutoffs.isna()].append(pd.Index(older))
+        if len(whole):
+            df_whole = storage.read_table(building_path, table, columns=columns, ids=whole)
+            df = pd.concat([df[~df[id_col].isin(older)], df_whole], ignore_index=True)
+
+    cutoff = df[id_col].map(cutoffs)
+    recent = cutoff.isna() | (df['ts'] >= cutoff)
+    previous = df[~recent & df['ts'].notna()].sort_values([id_col, 'ts'], kind='stable').groupby(id_col).tail(1)
+    return pd.concat([previous, df[recent]], ignore_index=True)
+
+def series_cutoffs(ids, previous_marks:dict, current_marks:dict=None) -> pd.Series:
+    """
+    First hour to recompute of every series in `ids`: the hour of its newest
+    raw sample in the fetch state the earlier output was made from (its
+    high-water mark, new samples are only appended after it), NaT for series
+    without one. Series whose mark is the same in `current_marks` have no
+    new samples and are left out.
+    """
+    ids = pd.Index(ids)
+    previous = schema.parse_ts(pd.Series([previous_marks.get(str(i)) for i in ids], index=ids, dtype=object))
+    if current_marks is not None:
+        current = schema.parse_ts(pd.Series([current_marks.get(str(i)) for i in ids], index=ids, dtype=object))
+        previous = previous[~(previous.eq(current) | (previous.isna() & current.isna()))]
+    return previous.dt.floor('h')
+
+def main_incremental(building_id:int, previous:pd.DataFrame, previous_state:dict, engine:str="numpy", local_path:str=None, dtype=np.float64):
+    """
+    main for a building whose earlier resampled output `previous` (its rows
+    of ResampledData, see storage.load_resampled) was made from the raw data
+    of the fetch state `previous_state` (see cml_dataset.update_fetch_state).
+    Every room is recomputed, with its HCAs, from the earliest new hour of
+    itself and its HCAs on (at most its last hour in `previous`) and merged
+    with the earlier hours; rooms without earlier output get their whole
+    history. Same rows as main, as long as the raw data was only appended
+    to since `previous_state`.
+    """
+    local_path = local_path or get_local_copy(building_id)
+    index = load_index(local_path)
+    building_path = f"{local_path}/building-{building_id}"
+    state = load_fetch_state(building_path) or {}
+
+    last_hour = previous.groupby('room_id')['ts'].max() if not previous.empty else pd.Series(dtype='datetime64[us, UTC]')
+    rooms = np.union1d(index.rooms_of_building(building_id), last_hour.index.to_numpy(dtype=np.int64))
+    hca_rooms = index.coefficients()['room_id']
+    hca_rooms = hca_rooms[hca_rooms.isin(rooms)]
+
+    # a room restarts at the earliest cutoff of itself and its HCAs, NaT (whole history) wins
+    room_series = series_cutoffs(rooms, previous_state.get("rooms", {}), state.get("rooms"))
+    hca_series = series_cutoffs(hca_rooms.index, previous_state.get("hcas", {}), state.get("hcas"))
+    candidates = pd.concat([
+        last_hour.reindex(rooms),
+        room_series,
+        pd.Series(hca_series.to_numpy(), index=hca_rooms.reindex(hca_series.index).to_numpy()),
+    ])
+    whole = candidates.isna().groupby(level=0).any()
+    room_cutoffs = candidates.groupby(level=0).min().reindex(rooms).mask(whole.reindex(rooms, fill_value=True))
+    hca_cutoffs = pd.Series(room_cutoffs.reindex(hca_rooms.to_numpy()).to_numpy(), index=hca_rooms.index)
+
+    df_room = read_recent(building_path, "room_temp_ts", ['room_id', 'ts', 'temperature'], room_cutoffs)
+    df_hca = read_recent(building_path, "allocator_ts", ['heat_cost_allocator_id', 'ts', 'temperature_1', 'temperature_2'], hca_cutoffs)
+    print(f"Building {building_id}: recomputing {len(df_room)} room and {len(df_hca)} HCA samples")
+    if df_room.empty and df_hca.empty:
+        return schema.apply(previous.reindex(columns=OUTPUT_COLUMNS).assign(building_id=building_id))
+
+    coefficients = precompute_coefficients(index.coefficients().reset_index())
+    combined = resample_frames(df_room, df_hca, building_id, index.buildings, coefficients, engine=engine, dtype=dtype)
+    cutoff = combined['room_id'].map(room_cutoffs)
+    combined = combined[cutoff.isna() | (combined['ts'] >= cutoff)]
+    kept = previous[previous['ts'] < previous['room_id'].map(room_cutoffs)]
+    combined = pd.concat([kept.reindex(columns=OUTPUT_COLUMNS), combined.reindex(columns=OUTPUT_COLUMNS)], ignore_index=True)
+    combined = combined.sort_values(['room_id', 'ts'], kind='stable', ignore_index=True)
+    combined['building_id'] = building_id
+    print(f"rooms present in building {building_id}: {combined['room_id'].nunique()}")
+    return schema.apply(combined)
+
 def safe_main(building_id:int):
     try:
         result = main(building_id)
@@ -217,59 +472,254 @@ def safe_main(building_id:int):
         print(f"Error processing building {building_id}: {e}")
         return pd.DataFrame()  # Return an empty DataFrame on error
 
+def resample_partition(building_id:int, output_dir:str, chunked:bool=False, previous_path:str=None, local_path:str=None,
+                       previous_state:dict=None):
+    """
+    Resamples one building straight into its partition of the ResampledData
+    layout under `output_dir`, incrementally on top of the ResampledData copy
+    at `previous_path` if given together with the fetch state its output was
+    made from (see incremental_states) and the raw tables are Parquet.
+    `local_path` is the Building dataset copy, downloaded here if not given.
+    Returns the partition's manifest entry, None if the building failed or
+    has no rows.
+    """
+    writer = storage.PartitionPageWriter(output_dir, building_id)
+    try:
+        incremental = previous_path is not None and previous_state is not None
+        if incremental:
+            local_path = local_path or get_local_copy(building_id)
+            # CSV tables are read whole, incremental is slower there than a full run
+            building_path = f"{local_path}/building-{building_id}"
+            if not all(os.path.isdir(f"{building_path}/{table}") for table in ("room_temp_ts", "allocator_ts")):
+                print(f"Building {building_id} has CSV raw tables, resampling it in full")
+                incremental = False
+        with writer:
+            if incremental:
+                previous = storage.load_resampled(previous_path, building_ids=[building_id])
+                writer.write(main_incremental(building_id, previous, previous_state, local_path=local_path))
+            elif chunked:
+                main_chunked(building_id, writer, local_path=local_path)
+            else:
+                writer.write(main(building_id, local_path=local_path).reindex(columns=OUTPUT_COLUMNS))
+        print(f"Completed processing for building {building_id}")
+    except Exception as e:
+        print(f"Error processing building {building_id}: {e}")
+        shutil.rmtree(writer.path, ignore_errors=True)
+        return None
+    return writer.manifest(output_dir) if writer.rows else None
+
+def get_building_dataset(building_id:int):
+    # newest version, incremental fetches publish 0.0.2, 0.0.3, ...
+    dataset = latest_building_dataset(building_id)
+    if dataset is None:
+        raise ValueError(f"No completed Building dataset for building {building_id}")
+    return dataset
+
 def get_local_copy(building_id:int):
-    dataset = Dataset.get(dataset_project='ForeSightNEXT/BaltBest',dataset_name=f"Building-{building_id}", dataset_version='0.0.1')
-    local_path = dataset.get_local_copy()
+    dataset = get_building_dataset(building_id)
+    local_path = dataset_cache.cached_copy(dataset)
 
     return local_path
 
+def building_sources(building_ids):
+    """
+    Id of the Building dataset every building would be resampled from: the
+    newest version, the same lookup as the fetch side and get_local_copy.
+    """
+    sources = {}
+    for building_id in building_ids:
+        try:
+            dataset = latest_building_dataset(building_id)
+        except Exception as e:
+            print(f"Could not look up the Building dataset of building {building_id}: {e}")
+            continue
+        if dataset is None:
+            print(f"No Building dataset for building {building_id}")
+            continue
+        sources[str(building_id)] = dataset.id
+    return sources
+
+def latest_resampled():
+    try:
+        return Dataset.get(dataset_project='ForeSightNEXT/BaltBest/resampled', dataset_name='ResampledData', only_completed=True)
+    except Exception as e:
+        print(f"No previous resampled output: {e}")
+        return None
+
+def incremental_states(sources:dict, previous) -> dict:
+    """
+    {building_id: fetch state} of the Building datasets the ResampledData
+    dataset `previous` was resampled from, read from their fingerprints,
+    for the buildings whose current Building dataset in `sources` only
+    appended to that one through incremental fetches. The other buildings
+    are resampled in full: a full fetch may have filled in older samples.
+    """
+    try:
+        previous_sources = previous.get_metadata("building_datasets") or {}
+    except Exception as e:
+        print(f"No building datasets recorded in the previous resampled output: {e}")
+        return {}
+    states = {}
+    for b, dataset_id in sources.items():
+        previous_id = previous_sources.get(b)
+        if previous_id is None:
+            continue
+        try:
+            if previous_id != dataset_id and previous_id not in Dataset.get(dataset_id=dataset_id).get_dependency_graph():
+                print(f"Building {b} was fetched in full since the previous resampled output, resampling it in full")
+                continue
+            fingerprint = get_fingerprint(Dataset.get(dataset_id=previous_id))
+        except Exception as e:
+            print(f"Could not read the fetch state of building {b}: {e}")
+            continue
+        if not fingerprint or fingerprint.get("series") is None:
+            print(f"No fetch state recorded for building {b}, resampling it in full")
+            continue
+        states[int(b)] = fingerprint["series"]
+    return states
+
+def reuse_partitions(sources:dict, output_dir:str, previous):
+    """
+    Copies the partitions of the ResampledData dataset `previous` for the
+    buildings whose Building dataset is still the one they were resampled
+    from into `output_dir`. Returns their manifest entries.
+    """
+    try:
+        previous_sources = previous.get_metadata("building_datasets") or {}
+    except Exception as e:
+        print(f"No building datasets recorded in the previous resampled output: {e}")
+        return []
+    unchanged = [int(b) for b, dataset_id in sources.items() if previous_sources.get(b) == dataset_id]
+    if not unchanged:
+        return []
+    local_path = dataset_cache.cached_copy(previous)
+    # older versions are a single resampled_data.csv, read it once
+    legacy = None
+    if not os.path.isdir(os.path.join(local_path, storage.RESAMPLED_TABLE)):
+        legacy = storage.load_resampled(local_path, building_ids=unchanged)
+    manifests = []
+    for building_id in unchanged:
+        if legacy is None:
+            df = storage.load_resampled(local_path, building_ids=[building_id])
+        else:
+            df = legacy[legacy['building_id'] == building_id]
+        with storage.PartitionPageWriter(output_dir, building_id) as writer:
+            writer.write(df)
+        if writer.rows:
+            manifests.append(writer.manifest(output_dir))
+    print(f"Reusing resampled output of unchanged buildings {[m['building_id'] for m in manifests]}")
+    return manifests
+
 def resample_remote():
     task = Task.init(project_name='ForeSightNEXT/BaltBest', task_name='Resample Test Remote Execution')
+    # set by the pipeline with --skip_unchanged
+    # chunked: resample room by room and stream the output, for buildings too large for memory
+    # incremental: only recompute the hours after the last ResampledData, set with --incremental (Parquet raw tables only)
+    params = task.connect({'reuse_unchanged': False, 'chunked': False, 'incremental': False})
     task.set_packages(packages='requirements.txt')
     task.execute_remotely(queue_name="default")
     #building_ids = [58, 26, 57, 52, 17, 2, 45, 16, 47, 50, 28, 13, 46, 39, 14, 53, 18, 73, 7, 66, 38, 74, 4, 20, 23, 21, 10, 24, 48, 5, 31]
     building_ids = [4, 7, 10, 13, 14, 16, 17, 18, 20, 21, 23, 24, 26, 28, 38, 39, 45, 46, 47, 50, 52, 53, 57, 58, 66, 73, 74]
     #res = main(20)
     absolute_path = f"/tmp/resampled"
+    # the whole directory is published, drop partitions of earlier runs
+    shutil.rmtree(absolute_path, ignore_errors=True)
     os.makedirs(absolute_path, exist_ok=True)
 
     #res.to_csv("resampled_building_20.csv",index=False)
     #print(res.room_id.unique())
-    results = Parallel(n_jobs=4)(delayed(safe_main)(building_id) for building_id in building_ids)
-    final_df = pd.concat(results, ignore_index=True)
-    final_df.to_csv(f'{absolute_path}/resampled_data.csv', index=False)
-    Task.current_task().upload_artifact(name="resampled_data", artifact_object=final_df)
+    sources = building_sources(building_ids)
+    previous = latest_resampled() if params['reuse_unchanged'] or params['incremental'] else None
+    manifests = reuse_partitions(sources, absolute_path, previous) if params['reuse_unchanged'] and previous else []
+    previous_path = dataset_cache.cached_copy(previous) if params['incremental'] and previous else None
+    previous_states = incremental_states(sources, previous) if previous_path else {}
+    unchanged = {m['building_id'] for m in manifests}
+    todo = [building_id for building_id in building_ids if building_id not in unchanged]
+    # Building datasets download in the background, in the order they finish;
+    # workers write their partitions themselves and only send back the manifest
+    copies = dataset_cache.prefetch(todo, get_local_copy)
+    results = Parallel(n_jobs=4)(
+        delayed(resample_partition)(building_id, absolute_path, params['chunked'], previous_path, local_path,
+                                    previous_states.get(building_id))
+        for building_id, local_path in copies if local_path is not None
+    )
+    # failed buildings are not recorded, so the next run retries them
+    manifests += [m for m in results if m is not None]
+    manifests.sort(key=lambda m: m['building_id'])
+    done = {m['building_id'] for m in manifests}
+    with open(f'{absolute_path}/manifest.json', 'w') as f:
+        json.dump(manifests, f, indent=2)
+    print(f"Resampled {len(done)} buildings, {sum(m['rows'] for m in manifests)} rows")
+    Task.current_task().upload_artifact(name="resampled_manifest", artifact_object=f'{absolute_path}/manifest.json')
     new_dataset = Dataset.create(
         dataset_project='ForeSightNEXT/BaltBest/resampled',
         dataset_name='ResampledData',
         dataset_version='0.0.1'
     )
-    new_dataset.add_files(f'{absolute_path}/resampled_data.csv')
+    new_dataset.add_files(absolute_path)
+    new_dataset.set_metadata({b: d for b, d in sources.items() if int(b) in done}, metadata_name="building_datasets", ui_visible=False)
     new_dataset.upload()
     new_dataset.finalize()
-def fetch_units(path,building_id:int):
+def join_units(df_units:pd.DataFrame, lookup:np.ndarray):
+    """
+    Inner join of units rows with the room and building of their HCA, like
+    merging hca_table, by indexing the hca_lookup_file array. Keeps row order.
+    """
+    ids = df_units['heat_cost_allocator_id'].fillna(-1).to_numpy(dtype=np.int64)
+    known = (ids >= 0) & (ids < lookup.shape[1])
+    room = np.full(len(ids), -1, dtype=np.int32)
+    building = np.full(len(ids), -1, dtype=np.int32)
+    room[known] = lookup[0, ids[known]]
+    building[known] = lookup[1, ids[known]]
+    keep = room >= 0
+    return df_units[keep].assign(room_id=room[keep], building_id=building[keep]).reset_index(drop=True)
+
+def fetch_units(path,building_id:int, lookup_file:str=None):
     try:
-        try:
-            df_units = pd.read_csv(f"{path}/building-{building_id}/units_ts.csv", compression='gzip', index_col=0)
-        except Exception:
-            df_units = pd.read_csv(f"{path}/building-{building_id}/units_ts.csv", index_col=0)
+        if os.path.isdir(f"{path}/building-{building_id}/units_ts"):
+            df_units = storage.read_table(f"{path}/building-{building_id}", "units_ts")
+        else:
+            # cml_dataset writes units_ts.csv without index, older copies may have one
+            df_units = storage.drop_csv_index(storage.read_csv(f"{path}/building-{building_id}/units_ts.csv"))
     except Exception as e:
         print(f"Error reading units data for building {building_id}: {e}")
         return pd.DataFrame()  # Return empty DataFrame on error
-    hca_metadata = pd.read_csv(f"{path}/hca_metadata.csv")
-    hca_metadata = hca_metadata[['heat_cost_allocator_id','room_id']]
-    rooms_metadata = pd.read_csv(f"{path}/rooms_metadata.csv")
-    rooms_metadata = rooms_metadata[['room_id','building_id']]
-    metadata = hca_metadata.merge(rooms_metadata, on='room_id',how='inner')
-    df = df_units.merge(metadata, on='heat_cost_allocator_id',how='inner')
-    return df
+    # the join table is built once per metadata version and memory-mapped here
+    lookup = np.load(lookup_file or hca_lookup_file(path), mmap_mode='r')
+    df = join_units(schema.apply(df_units), lookup)
+    return schema.apply(df)
     #return df_units
 
+def units_partition(path:str, building_id:int, output_dir:str, lookup_file:str, chunksize:int=1_000_000):
+    """
+    fetch_units straight into the building's partition of the UnitsData
+    layout under `output_dir`, chunk by chunk for CSV input. Returns the
+    partition's manifest entry, None if the building failed or has no rows.
+    """
+    lookup = np.load(lookup_file, mmap_mode='r')
+    building_path = f"{path}/building-{building_id}"
+    writer = storage.PartitionPageWriter(output_dir, building_id, table=storage.UNITS_TABLE)
+    try:
+        with writer:
+            if os.path.isdir(f"{building_path}/units_ts"):
+                chunks = [storage.read_table(building_path, "units_ts")]
+            else:
+                chunks = storage.iter_csv(f"{building_path}/units_ts.csv", chunksize)
+            for chunk in chunks:
+                writer.write(join_units(schema.apply(storage.drop_csv_index(chunk)), lookup))
+    except Exception as e:
+        print(f"Error reading units data for building {building_id}: {e}")
+        shutil.rmtree(writer.path, ignore_errors=True)
+        return None
+    return writer.manifest(output_dir) if writer.rows else None
+
 def fetch_units_remote():
     task = Task.init(
         project_name='ForeSightNEXT/BaltBest',
         task_name='Fetch Units Remote Execution'
     )
+    # partitioned: write every building's joined units to the UnitsData dataset instead of one artifact
+    params = task.connect({'partitioned': False})
     task.set_packages(packages='requirements.txt')
     task.execute_remotely(queue_name="default")
 
@@ -278,14 +728,39 @@ def fetch_units_remote():
         dataset_name="BaltBest",
         dataset_version='0.0.1'
     )
-    local_path = dataset.get_local_copy()
+    local_path = dataset_cache.cached_copy(dataset)
 
     building_ids = [4, 7, 10, 13, 14, 16, 17, 18, 20, 21, 23, 24, 26, 28, 38, 39, 45, 46, 47, 50, 52, 53, 57, 58, 66, 73, 74]
+    lookup_file = hca_lookup_file(local_path)
+
+    if params['partitioned']:
+        absolute_path = "/tmp/units"
+        shutil.rmtree(absolute_path, ignore_errors=True)
+        os.makedirs(absolute_path, exist_ok=True)
+        results = Parallel(n_jobs=4)(
+            delayed(units_partition)(local_path, bid, absolute_path, lookup_file)
+            for bid in building_ids
+        )
+        manifests = [m for m in results if m is not None]
+        with open(f'{absolute_path}/manifest.json', 'w') as f:
+            json.dump(manifests, f, indent=2)
+        print(f"Joined units of {len(manifests)} buildings, {sum(m['rows'] for m in manifests)} rows")
+        Task.current_task().upload_artifact(name="units_manifest", artifact_object=f'{absolute_path}/manifest.json')
+        new_dataset = Dataset.create(
+            dataset_project='ForeSightNEXT/BaltBest/resampled',
+            dataset_name='UnitsData',
+            dataset_version='0.0.1'
+        )
+        new_dataset.add_files(absolute_path)
+        new_dataset.upload()
+        new_dataset.finalize()
+        return
 
     res = Parallel(n_jobs=4)(
         delayed(fetch_units)(
             local_path,
-            bid
+            bid,
+            lookup_file
         )
         for bid in building_ids
     )
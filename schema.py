@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+# Column types shared by every table of the pipeline: the raw room / HCA /
+# units series of cml_dataset, the resampled output and the QA inputs. Ids
+# fit int32, the sensors deliver fewer significant digits than float32
+# holds, and `ts` is parsed once, when a table enters the pipeline, into UTC
+# datetime64. Computations may upcast internally, outputs are cast back.
+
+ID_TYPE = "int32"
+VALUE_TYPE = "float32"
+TS_UNIT = "us"
+
+ID_COLUMNS = ["room_id", "heat_cost_allocator_id", "building_id", "unit_id"]
+VALUE_COLUMNS = [
+    "temperature", "temperature_1", "temperature_2", "units",
+    "room_side_hca_temp", "heater_side_hca_temp", "hca_units", "outside_temp", "inside_temp",
+]
+
+COLUMN_TYPES = {
+    **{col: ID_TYPE for col in ID_COLUMNS},
+    **{col: VALUE_TYPE for col in VALUE_COLUMNS},
+}
+
+
+def parse_ts(values: pd.Series) -> pd.Series:
+    """UTC datetime64 of ISO strings or datetimes; unparseable values become NaT. Parsed input is returned as is."""
+    if isinstance(values.dtype, pd.DatetimeTZDtype) and str(values.dt.tz) == "UTC":
+        return values
+    return pd.to_datetime(values, utc=True, errors="coerce", format="ISO8601").dt.as_unit(TS_UNIT)
+
+
+def apply(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copy of `df` with the known columns cast to the pipeline schema. Ids
+    with missing values become nullable Int32, other columns are left alone.
+    """
+    df = df.copy()
+    for col, dtype in COLUMN_TYPES.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        values = df[col] if pd.api.types.is_numeric_dtype(df[col]) else pd.to_numeric(df[col], errors="coerce")
+        if dtype == ID_TYPE and values.isna().any():
+            dtype = "Int32"
+        df[col] = values.astype(dtype)
+    if "ts" in df.columns:
+        df["ts"] = parse_ts(df["ts"])
+    return df
+
+
+def format_ts(values: pd.Series) -> pd.Series:
+    """
+    Parsed `ts` back to the ISO strings the EBZ API sends (whole seconds,
+    2023-01-01T00:10:00Z), for CSV output: appended files keep one format.
+    Much faster than the date_format of to_csv.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+    naive = values.dt.tz_convert(None) if values.dt.tz is not None else values
+    text = np.char.add(np.datetime_as_string(naive.to_numpy().astype("datetime64[s]"), unit="s"), "Z")
+    return pd.Series(text, index=values.index, dtype=object).where(values.notna())
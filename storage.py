@@ -0,0 +1,295 @@
+import os
+import shutil
+import threading
+import uuid
+
+import pandas as pd
+
+import schema
+
+# Building datasets are either flat CSV files (room_temp_ts.csv, ...) or
+# Parquet directories of the same name partitioned by building and series id.
+
+TABLES = ["room_temp_ts", "allocator_ts", "units_ts"]
+
+SERIES_ID = {
+    "room_temp_ts": "room_id",
+    "allocator_ts": "heat_cost_allocator_id",
+    "units_ts": "heat_cost_allocator_id",
+}
+
+def to_csv(df: pd.DataFrame, path_or_file, header: bool = True):
+    if "ts" in df.columns:
+        df = df.assign(ts=schema.format_ts(df["ts"]))
+    df.to_csv(path_or_file, header=header, index=False)
+
+
+class CsvPageWriter:
+    """
+    Appends DataFrame pages to one CSV file as they arrive.
+
+    The header is fixed by the first non-empty page (or the existing file
+    when appending); later pages are aligned to it, unknown columns are
+    dropped. Safe to call from several fetch threads.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.columns = None
+        self.rows = 0
+        self._lock = threading.Lock()
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.columns = pd.read_csv(path, nrows=0).columns.tolist()
+            self._file = open(path, "a", newline="")
+        else:
+            self._file = open(path, "w", newline="")
+
+    def write(self, df: pd.DataFrame):
+        if df is None or df.empty:
+            return
+        with self._lock:
+            header = self.columns is None
+            if header:
+                self.columns = df.columns.tolist()
+            else:
+                dropped = df.columns.difference(self.columns)
+                if len(dropped):
+                    print(f"{os.path.basename(self.path)}: dropping unexpected columns {dropped.tolist()}")
+                df = df.reindex(columns=self.columns)
+            to_csv(df, self._file, header=header)
+            self.rows += len(df)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_parquet(df: pd.DataFrame, output_dir: str, table: str, building_id: int):
+    """Appends `df` as new files to the partitioned Parquet dataset `table`."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if df is None or df.empty:
+        return
+    df = schema.apply(df)
+    df["building_id"] = building_id
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        root_path=os.path.join(output_dir, table),
+        partition_cols=["building_id", SERIES_ID[table]],
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+    )
+
+
+def write_table(df: pd.DataFrame, output_dir: str, table: str, building_id: int, fmt: str = "csv", append: bool = False):
+    if fmt == "parquet":
+        write_parquet(df, output_dir, table, building_id)
+    elif append:
+        with CsvPageWriter(os.path.join(output_dir, f"{table}.csv"), append=True) as writer:
+            writer.write(df)
+    else:
+        to_csv(df, os.path.join(output_dir, f"{table}.csv"))
+
+
+def clear_table(output_dir: str, table: str):
+    """Removes leftovers of an earlier run, Parquet writes only ever add files."""
+    shutil.rmtree(os.path.join(output_dir, table), ignore_errors=True)
+    csv_file = os.path.join(output_dir, f"{table}.csv")
+    if os.path.exists(csv_file):
+        os.remove(csv_file)
+
+
+class ParquetPageWriter:
+    """Same interface as CsvPageWriter, every page becomes new partition files."""
+
+    def __init__(self, output_dir: str, table: str, building_id: int):
+        self.output_dir = output_dir
+        self.table = table
+        self.building_id = building_id
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def write(self, df: pd.DataFrame):
+        if df is None or df.empty:
+            return
+        write_parquet(df, self.output_dir, self.table, self.building_id)
+        with self._lock:
+            self.rows += len(df)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def page_writer(output_dir: str, table: str, building_id: int, fmt: str = "csv", append: bool = False):
+    if fmt == "parquet":
+        return ParquetPageWriter(output_dir, table, building_id)
+    return CsvPageWriter(os.path.join(output_dir, f"{table}.csv"), append=append)
+
+
+def read_csv(path: str, **kwargs) -> pd.DataFrame:
+    try:
+        return pd.read_csv(path, compression='gzip', **kwargs)
+    except Exception:
+        return pd.read_csv(path, **kwargs)
+
+
+def drop_csv_index(df: pd.DataFrame) -> pd.DataFrame:
+    """Drops the unnamed index column of CSVs written with the default index=True."""
+    return df.drop(columns=[col for col in df.columns if str(col).startswith("Unnamed: ")])
+
+
+def read_table(building_path: str, table: str, columns=None, ids=None, since=None) -> pd.DataFrame:
+    """
+    Loads one table of a building dataset directory, preferring the Parquet
+    layout. Only `columns` are read and, if given, only the series in `ids`
+    (room ids or HCA ids, depending on the table) and the samples at or
+    after the UTC timestamp `since`. Columns come back in the pipeline
+    schema, `ts` parsed.
+    """
+    id_col = SERIES_ID[table]
+    parquet_path = os.path.join(building_path, table)
+    if os.path.isdir(parquet_path):
+        filters = []
+        if ids is not None:
+            filters.append((id_col, "in", [int(i) for i in ids]))
+        if since is not None:
+            filters.append(("ts", ">=", pd.Timestamp(since)))
+        # hive partition columns come back as categoricals, apply casts them
+        return schema.apply(pd.read_parquet(parquet_path, columns=columns, filters=filters or None))
+
+    df = schema.apply(read_csv(os.path.join(building_path, f"{table}.csv"), usecols=columns))
+    if ids is not None:
+        df = df[df[id_col].isin(ids)]
+    if since is not None:
+        df = df[df["ts"] >= since]
+    return df
+
+
+def iter_csv(path: str, chunksize: int, **kwargs):
+    """pd.read_csv in chunks of `chunksize` rows, gzip or plain like read_csv."""
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    return pd.read_csv(path, compression="gzip" if gzipped else None, chunksize=chunksize, **kwargs)
+
+
+def spill_table(building_path: str, table: str, spill_dir: str, building_id: int, columns=None, chunksize: int = 100_000) -> str:
+    """
+    Rewrites the CSV `table` of a building as Parquet partitions per series
+    under `spill_dir`, one chunk at a time, so read_table can load a single
+    series without reading the whole file. Returns the directory to read the
+    table from: `building_path` if it is Parquet already or has no rows.
+    """
+    if os.path.isdir(os.path.join(building_path, table)):
+        return building_path
+    clear_table(spill_dir, table)
+    for chunk in iter_csv(os.path.join(building_path, f"{table}.csv"), chunksize, usecols=columns):
+        write_parquet(chunk, spill_dir, table, building_id)
+    return spill_dir if os.path.isdir(os.path.join(spill_dir, table)) else building_path
+
+
+# ResampledData is one Parquet file set per building under resampled/,
+# partitioned by building_id, plus a manifest.json describing the partitions.
+# UnitsData has the same layout under units/.
+
+RESAMPLED_TABLE = "resampled"
+UNITS_TABLE = "units"
+
+class PartitionPageWriter:
+    """
+    Same interface as CsvPageWriter, every page becomes the next part file
+    of one building's partition of `table`. The partition is emptied first.
+    Keeps what the manifest needs: rows, rooms and the ts range.
+    """
+
+    def __init__(self, output_dir: str, building_id: int, table: str = RESAMPLED_TABLE):
+        self.building_id = building_id
+        self.path = os.path.join(output_dir, table, f"building_id={building_id}")
+        self.rows = 0
+        self.rooms = set()
+        self.ts_min = None
+        self.ts_max = None
+        self._parts = 0
+        self._lock = threading.Lock()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def write(self, df: pd.DataFrame):
+        if df is None or df.empty:
+            return
+        # building_id is the partition key, not a column of the files
+        df = schema.apply(df.drop(columns=["building_id"], errors="ignore"))
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            df.to_parquet(os.path.join(self.path, f"part-{self._parts:05d}.parquet"), index=False)
+            self._parts += 1
+            self.rows += len(df)
+            self.rooms.update(df["room_id"].unique().tolist())
+            ts_min, ts_max = df["ts"].min(), df["ts"].max()
+            self.ts_min = ts_min if self.ts_min is None else min(self.ts_min, ts_min)
+            self.ts_max = ts_max if self.ts_max is None else max(self.ts_max, ts_max)
+
+    def manifest(self, output_dir: str) -> dict:
+        return {
+            "building_id": int(self.building_id),
+            "path": os.path.relpath(self.path, output_dir),
+            "rows": int(self.rows),
+            "rooms": len(self.rooms),
+            "ts_min": self.ts_min.isoformat() if self.ts_min is not None else None,
+            "ts_max": self.ts_max.isoformat() if self.ts_max is not None else None,
+        }
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_partitioned(path: str, table: str, columns=None, building_ids=None):
+    """
+    `table` of a dataset copy in the per-building partition layout as one
+    frame, None if the copy does not have it.
+    """
+    parquet_path = os.path.join(path, table)
+    if not os.path.isdir(parquet_path):
+        return None
+    filters = [("building_id", "in", [int(b) for b in building_ids])] if building_ids is not None else None
+    return schema.apply(pd.read_parquet(parquet_path, columns=columns, filters=filters))
+
+
+def load_resampled(path: str, columns=None, building_ids=None) -> pd.DataFrame:
+    """
+    Loads a ResampledData dataset copy as one table, from the partitioned
+    layout or the older single resampled_data.csv. Only `columns` are read
+    and, if given, only the buildings in `building_ids`.
+    """
+    df = load_partitioned(path, RESAMPLED_TABLE, columns, building_ids)
+    if df is not None:
+        return df
+
+    df = schema.apply(read_csv(os.path.join(path, "resampled_data.csv"), usecols=columns))
+    if building_ids is not None:
+        df = df[df["building_id"].isin(building_ids)]
+    return df
+
+
+def load_units(path: str, columns=None, building_ids=None) -> pd.DataFrame:
+    """Loads a UnitsData dataset copy (joined units of all buildings) as one table."""
+    df = load_partitioned(path, UNITS_TABLE, columns, building_ids)
+    if df is None:
+        raise FileNotFoundError(f"No {UNITS_TABLE} partitions in {path}")
+    return df